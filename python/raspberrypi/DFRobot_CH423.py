@@ -16,9 +16,25 @@ from __future__ import print_function
   @https://github.com/DFRobot/DFRobot_CH423
 '''
 
-import sys
 import time
-import smbus
+import functools
+from contextlib import contextmanager
+
+from DFRobot_CH423_transport import SMBusTransport, get_bus_lock
+from DFRobot_CH423_monitor import CH423BusMonitor
+from DFRobot_CH423_trace import CH423TraceRecorder
+from DFRobot_CH423_interrupt import CH423CallbackPool
+from DFRobot_CH423_compat import monotonic, monotonic_ns
+
+def _locked(func):
+  # run a driver method under the bus lock and publish the shadow registers for the lock-free getters
+  @functools.wraps(func)
+  def wrapper(self, *args, **kwargs):
+    with self._lock:
+      result = func(self, *args, **kwargs)
+      self._publish()
+      return result
+  return wrapper
 
 class DFRobot_CH423:
   ## Set system parameter command 
@@ -31,6 +47,8 @@ class DFRobot_CH423:
   CH423_CMD_SET_GPIO        =   0x30    
   ## Set bi-directional input/output pin command
   CH423_CMD_READ_GPIO       =  (0x4D >> 1) 
+  ## Set display data of digit 0 in display scan mode, digit n uses CH423_CMD_SET_DIG0 + n (DIG0 shares the command with GPIO)
+  CH423_CMD_SET_DIG0        =   0x30
   
   ## General-purpose output pin, GPO0 
   eGPO0     =   0 
@@ -119,17 +137,85 @@ class DFRobot_CH423:
   ARGS_BIT_DEC_H  = 2
   ARGS_BIT_INT_EN = 3
   ARGS_BIT_OD_EN  = 4
+  ARGS_BIT_INTENS = 5
   ARGS_BIT_SLEEP  = 6
 
-  def __init__(self):
-    self._bus       = smbus.SMBus(1)
+  ## 7-segment codes of hexadecimal digits 0~F, bit0~bit6 for segment a~g, bit7 for the decimal point
+  SEG_FONT = (0x3F, 0x06, 0x5B, 0x4F, 0x66, 0x6D, 0x7D, 0x07, 0x7F, 0x6F, 0x77, 0x7C, 0x39, 0x5E, 0x79, 0x71)
+
+  ## Pin numbers of the set bits of every 8-bit value
+  _BIT_INDEXES = tuple(tuple(i for i in range(8) if (v >> i) & 1) for v in range(256))
+
+  ## 24-bit output mask, GPIO0~GPIO7 (bit0~bit7)
+  MASK_GPIO    = 0x0000FF
+  ## 24-bit output mask, GPO0~GPO7 (bit8~bit15)
+  MASK_GPO0_7  = 0x00FF00
+  ## 24-bit output mask, GPO8~GPO15 (bit16~bit23)
+  MASK_GPO8_15 = 0xFF0000
+  ## 24-bit output mask, all GPIO and GPO pins
+  MASK_ALL     = 0xFFFFFF
+
+  def __init__(self, bus = 1, transport = None):
+    '''!
+      @brief Constructor
+      @param bus        I2C bus number used when no transport is given, default to be 1 (/dev/i2c-1)
+      @param transport  Object that carries the CH423 commands, such as SMBusTransport or CH423Simulator, default to be SMBusTransport(bus)
+      @note The I2C bus is opened by the first access, not by the constructor
+    '''
+    self._own_bus   = transport is None
+    if transport is None:
+      transport = SMBusTransport(bus)
+    self._bus       = transport
+    self._lock      = get_bus_lock(transport)
     self._args      = 0
     self._mode      = [0]*8
     self._cbs       = [0]*8
     self._int_value = 0
     self._gpo0_7    = 0
     self._gpo8_15   = 0
+    self._gpio      = 0
+    self._int_hi    = 0
+    self._int_lo    = 0
+    self._int_chg   = 0
+    self._cb_pool   = None
+    self._int_pins  = 0
+    self._int_cb    = 0
+    self._ring      = None
+    self._debouncer = None
+    self._counter   = None
+    self._batch_depth = 0
+    self._batch_args  = 0
+    self._pending     = {}
+    self._forced      = set()
+    self._written     = {}
+    self._skipped     = 0
+    self._snapshot    = (0, 0, 0)
+    self._stats       = None
+    self._trace       = None
+    self._activity    = 0
+    self._display_saved = None
+    self._retries     = 2
+    self._backoff     = 0.001
+    self._max_backoff = 0.05
+    self.reset_recovery_stats()
   
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.close()
+
+  def close(self):
+    '''!
+      @brief  Stop tracing and release the bus. A transport created by the constructor is closed, the shared handle of the bus is
+      @n  closed when no other driver uses it; a transport passed to the constructor stays open. The next access opens the bus again.
+    '''
+    with self._lock:
+      self.stop_trace()
+      if self._own_bus:
+        self._bus.close()
+
+  @_locked
   def begin(self, gpio_mode = eINPUT, gpo_mode = ePUSH_PULL):
     '''!
       @brief   Init module. The module has two groups of pins: bi-directional input/output GPIO0~GPIO7(can be set to input/output module simultaneously) 
@@ -141,6 +227,8 @@ class DFRobot_CH423:
       @n     eOPEN_DRAIN  GPO pin open-drain output mode, GPO only output low level or do not output in this mode.
       @n     ePUSH_PULL   GPO pin push-pull output mode, GPO can output high or low level in this mode.
       @return Return 0 if initialization succeeds, otherwise return non-zero.
+      @note The GPIO latch is set to 0xFF (all high, and the interrupt reference of all inputs); call resync() afterwards
+      @n  to take over the current pin levels instead.
     '''
     self._args      = 0
     if(gpio_mode < self.eOPEN_DRAIN):
@@ -149,10 +237,25 @@ class DFRobot_CH423:
     if (gpo_mode > self.eOUTPUT) and (gpo_mode <= self.ePUSH_PULL):
       if gpo_mode == self.eOPEN_DRAIN:
         self._args |= 1 << self.ARGS_BIT_OD_EN
-    self._set_system_args()
     self._int_value = 0xFF
+    # the GPIO latch gets a known value instead of the pin levels, an input held low from outside must not end up in it
+    self._gpio      = 0xFF
+    with self.batch():
+      self._write_reg(self.CH423_CMD_SET_GPIO, self._gpio, force = True)
+      self._set_system_args(force = True)
     return 0
 
+  @_locked
+  def resync(self):
+    '''!
+      @brief  Re-read the GPIO pin levels from the chip into the GPIO output shadow. Single-pin gpio_digital_write builds the
+      @n  output byte from this shadow instead of reading the pins back every time.
+      @return Level status of GPIO0~GPIO7
+    '''
+    self._gpio = self._read_gpio()
+    return self._gpio
+
+  @_locked
   def pin_mode(self, group, mode):
     '''!
       @brief  Set pin group mode. The module includes two groups of pins: GPIO(GPIO0~GPIO7) and GPO(GPO0~GPO15)
@@ -172,13 +275,15 @@ class DFRobot_CH423:
       else:
         self._args |= 1 << self.ARGS_BIT_IO_EN
       self._set_system_args()
-    elif group > self.eGPIO and mode > self.eOPEN_DRAIN:
+    elif group > self.eGPIO and mode >= self.eOPEN_DRAIN:
       if mode == self.eOPEN_DRAIN:
         self._args |= 1 << self.ARGS_BIT_OD_EN
       else:
         self._args &= ((~(1 << self.ARGS_BIT_OD_EN)) & 0xFF)
+      self._set_system_args()
 
-  def gpio_digital_write(self, gpio, level):
+  @_locked
+  def gpio_digital_write(self, gpio, level, force = False):
     '''!
       @brief  Set pin output level 
       @param gpio   GPIO pins, eGPIOPin_t enum variable member 
@@ -195,6 +300,7 @@ class DFRobot_CH423:
       @n     1            Parameter level, bit0 in 8-bit data is valid, which indicates outputting high level
       @n     0            Parameter level, bit0 in 8-bit data is valid, which indicates outputting low level
       @n     0x00~0xFF    If parameter gpioPin is GPIOTotal, bit0-bit7 of parameter level are valid data, corresponding to GPIO0-GPIO7 pins respectively.
+      @param force    Write even if the register already holds this value, default to be False (unchanged writes are skipped)
     '''
     if gpio < self.eGPIO0 or gpio > self.eGPIO_TOTAL:
       print("gpio argument range error.")
@@ -203,16 +309,17 @@ class DFRobot_CH423:
       print("level argument range(0~0xFF) error.")
       return None
     if gpio == self.eGPIO_TOTAL:
-      self._bus.write_byte(self.CH423_CMD_SET_GPIO, level)
+      self._gpio = level
+      self._write_reg(self.CH423_CMD_SET_GPIO, self._gpio, force)
       return None
-    state = self._read_gpio()
     if level:
-      level = state | (1 << gpio)
+      self._gpio |= (1 << gpio)
     else:
-      level = state & (~(1 << gpio))
-    self._bus.write_byte(self.CH423_CMD_SET_GPIO, level)
+      self._gpio &= (~(1 << gpio)) & 0xFF
+    self._write_reg(self.CH423_CMD_SET_GPIO, self._gpio, force)
 
-  def gpo_digital_write(self, gpo, level):
+  @_locked
+  def gpo_digital_write(self, gpo, level, force = False):
     '''!
       @brief  Set the pin to output high and low level, or control to output or stop (interrupt) low level。
       @param gpoPin   eGPOPin_t enum variable member 
@@ -237,6 +344,7 @@ class DFRobot_CH423:
       @n     HIGH or 1    When GPO pin group is set to push-pull output mode, output high; for open-drain mode, output low level 
       @n     LOW  or 0   When GPO pin group is set to push-pull output mode, output low, for open-drain mode, no signal output
       @n     0x00~0xFF   When gpoPin parameter is eGPOTotal, bit0~bit7 of level are all valid data, corresponding to pin GPO0~GPO7 or GPO8~GPO15
+      @param force    Write even if the register already holds this value, default to be False (unchanged writes are skipped)
     '''
     if gpo < self.eGPO0 or gpo > self.eGPO_TOTAL:
       print("gpo argument range error.")
@@ -247,25 +355,26 @@ class DFRobot_CH423:
     if gpo == self.eGPO_TOTAL:
       self._gpo8_15 = level
       self._gpo0_7  = level
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_H, self._gpo8_15)
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_L, self._gpo0_7)
+      with self.batch():
+        self._write_reg(self.CH423_CMD_SET_GPO_H, self._gpo8_15, force)
+        self._write_reg(self.CH423_CMD_SET_GPO_L, self._gpo0_7, force)
       return None
     if gpo > self.eGPO7:
       if level:
         self._gpo8_15 |= (1 << (gpo - 8))
       else:
         self._gpo8_15 &= (~(1 << (gpo - 8)))
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_H, self._gpo8_15)
-      print("_gpo8_15=%x"%self._gpo8_15)
+      self._write_reg(self.CH423_CMD_SET_GPO_H, self._gpo8_15, force)
     else:
       if level:
         self._gpo0_7 |= (1 << gpo)
       else:
         self._gpo0_7 &= (~(1 << gpo))
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_L, self._gpo0_7)
+      self._write_reg(self.CH423_CMD_SET_GPO_L, self._gpo0_7, force)
       #print("_gpo0_7=%x"%self._gpo0_7)
 
-  def group_digital_write(self, group, level):
+  @_locked
+  def group_digital_write(self, group, level, force = False):
     '''!
       @brief  Set IO output value by group 
       @param group    Group pin, ePinGroup_t enum variable member 
@@ -275,6 +384,7 @@ class DFRobot_CH423:
       @n     eGPO8_15 GPO pin 8~15, when setting this value, parameter level high 8bits are valid, bit8~bit15 correspond to output of pin GPO8~GPO15, indicating setting output value of pin 8~15 in GPO group
       @param level    16bit data or uGroupValue_t union value. Combining with group parameter to represent the pin value of a group. bit0~bit15 correspond to GPIO0~GPIO7(high 8bits invalid) or GPO0~GPO15
       @n     0x0000~0xFFFF  16bits data, bit0~bit15 have different meanings according to the value of parameter group. 
+      @param force    Write even if the register already holds this value, default to be False (unchanged writes are skipped)
     '''
     if group < self.eGPIO or group > self.eGPO8_15:
       print("group argument range error.")
@@ -283,25 +393,95 @@ class DFRobot_CH423:
       print("level argument range(0~0xFF) error.")
       return None
     if group == self.eGPIO:
-      cmd = level & 0xFF
-      self._bus.write_byte(self.CH423_CMD_SET_GPIO, cmd)
+      self._gpio = level & 0xFF
+      self._write_reg(self.CH423_CMD_SET_GPIO, self._gpio, force)
     elif group == self.eGPO:
       self._gpo8_15 = (level >> 8) & 0xFF
       self._gpo0_7  = level & 0xFF
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_H, self._gpo8_15)
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_L, self._gpo0_7)
+      with self.batch():
+        self._write_reg(self.CH423_CMD_SET_GPO_H, self._gpo8_15, force)
+        self._write_reg(self.CH423_CMD_SET_GPO_L, self._gpo0_7, force)
       #print("_gpo8_15=%x"%self._gpo8_15)
       #print("_gpo0_7=%x"%self._gpo0_7)
     elif group == self.eGPO0_7:
       self._gpo0_7  = level & 0xFF
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_L, self._gpo0_7)
+      self._write_reg(self.CH423_CMD_SET_GPO_L, self._gpo0_7, force)
       #print("_gpo0_7=%x"%self._gpo0_7)
     elif group == self.eGPO8_15:
       self._gpo8_15 = (level >> 8) & 0xFF
-      self._bus.write_byte(self.CH423_CMD_SET_GPO_H, self._gpo8_15)
+      self._write_reg(self.CH423_CMD_SET_GPO_H, self._gpo8_15, force)
       #print("_gpo8_15=%x"%self._gpo8_15)
     
   
+  def get_outputs(self):
+    '''!
+      @brief  Get the output levels of all 24 output lines as last written by the driver
+      @return 24-bit value, bit0~bit7 for GPIO0~GPIO7, bit8~bit23 for GPO0~GPO15
+      @note Lock-free, returns the state left by the last completed driver call
+    '''
+    return self._snapshot[0]
+
+  def get_system_args(self):
+    '''!
+      @brief  Get the system parameter byte as last set by the driver, lock-free
+      @return Bits ARGS_BIT_IO_EN~ARGS_BIT_SLEEP
+    '''
+    return self._snapshot[1]
+
+  def get_interrupt_reference(self):
+    '''!
+      @brief  Get the reference levels the GPIO inputs are compared with to raise an interrupt, lock-free
+      @return bit0~bit7 for GPIO0~GPIO7
+    '''
+    return self._snapshot[2]
+
+  @_locked
+  def write_masked(self, mask, value, force = False):
+    '''!
+      @brief  Set the output level of several pins at once. Only the output registers containing changed pins are written.
+      @param mask     24-bit pin mask, bit0~bit7 for GPIO0~GPIO7, bit8~bit23 for GPO0~GPO15, pins whose bit is 0 keep their level
+      @param value    24-bit levels for the pins selected by mask, same bit layout as mask
+      @param force    Write even if the register already holds this value, default to be False (unchanged writes are skipped)
+    '''
+    if mask < 0 or mask > self.MASK_ALL:
+      print("mask argument range(0~0xFFFFFF) error.")
+      return None
+    value &= mask
+    with self.batch():
+      if mask & self.MASK_GPIO:
+        self._gpio = (self._gpio & ~mask & 0xFF) | (value & 0xFF)
+        self._write_reg(self.CH423_CMD_SET_GPIO, self._gpio, force)
+      if mask & self.MASK_GPO0_7:
+        self._gpo0_7 = (self._gpo0_7 & ~(mask >> 8) & 0xFF) | ((value >> 8) & 0xFF)
+        self._write_reg(self.CH423_CMD_SET_GPO_L, self._gpo0_7, force)
+      if mask & self.MASK_GPO8_15:
+        self._gpo8_15 = (self._gpo8_15 & ~(mask >> 16) & 0xFF) | ((value >> 16) & 0xFF)
+        self._write_reg(self.CH423_CMD_SET_GPO_H, self._gpo8_15, force)
+
+  def set_mask(self, mask):
+    '''!
+      @brief  Set several pins to level 1 at once (high level in push-pull mode)
+      @param mask  24-bit pin mask, bit0~bit7 for GPIO0~GPIO7, bit8~bit23 for GPO0~GPO15
+    '''
+    self.write_masked(mask, mask)
+
+  def clear_mask(self, mask):
+    '''!
+      @brief  Set several pins to level 0 at once (low level in push-pull mode)
+      @param mask  24-bit pin mask, bit0~bit7 for GPIO0~GPIO7, bit8~bit23 for GPO0~GPO15
+    '''
+    self.write_masked(mask, 0)
+
+  @_locked
+  def toggle_mask(self, mask):
+    '''!
+      @brief  Invert the output level of several pins at once
+      @param mask  24-bit pin mask, bit0~bit7 for GPIO0~GPIO7, bit8~bit23 for GPO0~GPO15
+    '''
+    # from the shadows, the get_outputs() snapshot is only published when a locked call returns
+    outputs = self._gpio | (self._gpo0_7 << 8) | (self._gpo8_15 << 16)
+    self.write_masked(mask, ~outputs)
+
   def gpio_digital_read(self, gpio):
     '''!
       @brief  Read pin level value of GPIO group 
@@ -326,6 +506,7 @@ class DFRobot_CH423:
     return (rslt >> gpio) & 1
     
 
+  @_locked
   def gpio_attach_interrupt(self, gpio, mode, callback):
     '''!
       @brief Set the external interrupt mode and interrupt service function of GPIO pins
@@ -347,7 +528,7 @@ class DFRobot_CH423:
       @n     eRISING    Rising edge interrupt, when the pin that sets to this mode detects a rising edge interrupt, pin GPO15 outputs a high to low level(Falling edge)
       @n     eFALLING   Falling edge interrupt, when the pin that sets to this mode detects a falling edge interrupt, pin GPO15 outputs a high to low level(Falling edge)
       @n     eCHANGE    Double edge jump interrupt, when the pin that sets to this mode detects a falling edge or rising edge, pin GPO15 outputs a high to low level(Falling edge)
-      @param callback  Point to interrupt service function 
+      @param callback  Point to interrupt service function, 0 or None to only record the interrupt in the event ring (see set_event_ring)
     '''
     if gpio < self.eGPIO0 or gpio > self.eGPIO_TOTAL:
       print("gpio argument range error.")
@@ -356,7 +537,7 @@ class DFRobot_CH423:
       print("mode argument range error.")
       return None
     bit = 0
-    if mode == self.eLOW or mode == self.eRISING:
+    if mode == self.eHIGH or mode == self.eRISING:
       bit = 0
     else:
       bit = 1
@@ -370,6 +551,8 @@ class DFRobot_CH423:
         self._mode[i] = mode
         self._cbs[i] = callback
         i +=1
+      self._int_pins = 0xFF
+      self._update_int_masks()
       return None
     if bit:
       self._int_value |= (1 << gpio) 
@@ -377,64 +560,295 @@ class DFRobot_CH423:
       self._int_value &= (~(1 << gpio))
     self._mode[gpio] = mode
     self._cbs[gpio] = callback 
+    self._int_pins |= 1 << gpio
+    self._update_int_masks()
     
+  @_locked
   def enable_interrupt(self):
     '''!
       @brief  Enable GPIO external interrupt
     '''
+    if self._display_saved is not None:
+      # the display drives the GPIO pins, the interrupt is enabled when display_mode(0) switches it off
+      self._display_saved = (self._display_saved[0], self._int_value, 1 << self.ARGS_BIT_INT_EN)
+      return
     self._args |= (1 << self.ARGS_BIT_INT_EN)
     self._args &= ~(1 << self.ARGS_BIT_DEC_H)
     self._set_system_args()
     self.gpio_digital_write(self.eGPIO_TOTAL, self._int_value)
 
+  @_locked
   def disable_interrupt(self):
     '''!
       @brief  Disable GPIO external interrupt
     '''
+    if self._display_saved is not None:
+      self._display_saved = self._display_saved[:2] + (0,)
+      return
     self._args &= ~(1 << self.ARGS_BIT_INT_EN)
     self._set_system_args()
 
-  def poll_interrupts(self):
+  def poll_interrupts(self, timestamp = None):
     '''!
       @brief  Poll GPIO interrupt event
+      @param timestamp  Monotonic time of the interrupt in seconds, recorded in the event ring, default to be the time of the poll
+      @note The bus lock is released while the debouncer waits and while the callbacks run. The last GPIO read is evaluated
+      @n  and the interrupt reference re-armed without releasing the lock, so concurrent polls never compare stale levels.
+    '''
+    debouncer = self._debouncer
+    with self._lock:
+      state = self._read_gpio()
+      if debouncer is not None:
+        state = debouncer.update(state)
+        n = debouncer.max_samples
+        while debouncer.pending and n:
+          self._lock.release()
+          try:
+            time.sleep(debouncer.interval)
+          finally:
+            self._lock.acquire()
+          state = debouncer.update(self._read_gpio())
+          n -= 1
+      if self._counter is not None:
+        self._counter.feed(state, None if timestamp is None else int(timestamp * 1000000000))
+      fired = (state ^ self._int_value) & ((self._int_hi & state) | (self._int_lo & ~state) | self._int_chg)
+      if not fired:
+        return None
+      if self._ring is not None:
+        self._ring.append(monotonic_ns() if timestamp is None else int(timestamp * 1000000000), fired, state)
+      change = fired & self._int_chg
+      if change:
+        self._int_value = (self._int_value & ~change) | (state & change)
+        self.gpio_digital_write(self.eGPIO_TOTAL, self._int_value)
+      fired &= self._int_cb
+      if not fired:
+        return None
+      cbs  = list(self._cbs)
+      pool = self._cb_pool
+    if pool is None:
+      for i in self._BIT_INDEXES[fired]:
+        cbs[i](i)
+    else:
+      for i in self._BIT_INDEXES[fired]:
+        pool.submit(i, cbs[i])
+
+  def set_debouncer(self, debouncer):
+    '''!
+      @brief  Debounce the GPIO levels evaluated by poll_interrupts(). While a pin is bouncing, poll_interrupts() keeps sampling
+      @n  at the debouncer interval until the level is stable, so only stable transitions reach the callbacks.
+      @param debouncer  CH423Debouncer object, None to evaluate the raw levels again
+    '''
+    with self._lock:
+      if debouncer is not None:
+        debouncer.reset(self._int_value)
+      self._debouncer = debouncer
+
+  def set_edge_counter(self, counter):
+    '''!
+      @brief  Count the GPIO edges seen by poll_interrupts(), use eCHANGE interrupts so every edge triggers a poll
+      @param counter  CH423EdgeCounter object, None to stop counting
     '''
-    state = self._read_gpio()
-    #print("poll_interrupts state=%x, _int_value=%x"%(state,self._int_value))
-    temp = self._int_value
-    i = 0
-    flag = False
-    while i < 8:
-      bit = (state >> i) & 1
-      bit1 = (self._int_value >> i) & 1
-      #print("i=%d, bit=%d, bit1=%d"%(i, bit, bit1))
-      if self._cbs[i] != 0 and bit != bit1:
-        if (((self._mode[i] == self.eHIGH) or (self._mode[i] == self.eRISING)) and (bit != 1)) or ((self._mode[i] == self.eLOW or self._mode[i] == self.eFALLING) and (bit != 0)):
-          i += 1
-          continue
-        if self._mode[i] == self.eCHANGE:
-          flag = True
-          if bit:
-            temp |= 1 << i
-          else:
-            temp &= ~(1 << i)
-        self._cbs[i](i)
-        #print("i=%d"%i)
-      i += 1
-    self._int_value = temp
-    if flag:
-      self.gpio_digital_write(self.eGPIO_TOTAL, temp)
+    with self._lock:
+      self._counter = counter
 
+  def set_event_ring(self, ring):
+    '''!
+      @brief  Record every interrupt found by poll_interrupts() as (monotonic_ns, fired pin mask, GPIO level) in a CH423EventRing
+      @param ring  CH423EventRing object, None to stop recording
+    '''
+    with self._lock:
+      self._ring = ring
+
+  def enable_callback_pool(self, workers = 2, queue_size = 64, overflow = None):
+    '''!
+      @brief  Run the interrupt callbacks on a CH423CallbackPool instead of inside poll_interrupts(). The callbacks of one pin
+      @n  keep their order, poll_interrupts() only queues them and returns.
+      @param workers     Number of worker threads, default to be 2
+      @param queue_size  Events each worker can queue, default to be 64
+      @param overflow    Policy when a queue is full, None for CH423CallbackPool.DROP_OLDEST
+      @n     CH423CallbackPool.DROP_OLDEST   Drop the oldest queued event (default)
+      @n     CH423CallbackPool.DROP_NEWEST   Drop the new event
+      @n     CH423CallbackPool.BLOCK         Wait in poll_interrupts() for a free slot
+      @return CH423CallbackPool object, get_stats() reports queue depth and drops
+    '''
+    if overflow is None:
+      overflow = CH423CallbackPool.DROP_OLDEST
+    pool = CH423CallbackPool(workers, queue_size, overflow)
+    with self._lock:
+      old, self._cb_pool = self._cb_pool, pool
+    # closed without the lock, its queued callbacks may call the driver
+    if old is not None:
+      old.close()
+    return pool
+
+  def disable_callback_pool(self, wait = True):
+    '''!
+      @brief  Run the interrupt callbacks inside poll_interrupts() again
+      @param wait  Run the queued callbacks before the workers stop, default to be True
+    '''
+    with self._lock:
+      pool, self._cb_pool = self._cb_pool, None
+    if pool is not None:
+      pool.close(wait)
+
+  def _update_int_masks(self):
+    hi = lo = chg = cb = 0
+    for i in range(8):
+      if not (self._int_pins >> i) & 1:
+        continue
+      if self._cbs[i]:
+        cb |= 1 << i
+      if self._mode[i] == self.eHIGH or self._mode[i] == self.eRISING:
+        hi |= 1 << i
+      elif self._mode[i] == self.eLOW or self._mode[i] == self.eFALLING:
+        lo |= 1 << i
+      else:
+        chg |= 1 << i
+    self._int_hi  = hi
+    self._int_lo  = lo
+    self._int_chg = chg
+    self._int_cb  = cb
+
+  @_locked
   def sleep(self):
     '''!
       @brief  Enter sleep mode 
       @note It can be waken up in two ways: 
       @n 1. An external interrupt occurs on the GPIO pin
-      @n 2. Execute pin operation
+      @n 2. Execute pin operation that accesses the bus. Writes of an unchanged value are skipped without bus access,
+      @n    so they do not wake the chip; pass force = True or write a new value.
     '''
     self._args |= 1 << self.ARGS_BIT_SLEEP
-    self._set_system_args()
-    self._args &= ~(1 << self.ARGS_BIT_SLEEP)
-  
+    try:
+      self._set_system_args()
+    finally:
+      self._args &= ~(1 << self.ARGS_BIT_SLEEP)
+    if not self._batch_depth:
+      # the chip clears the sleep bit itself when it wakes up, so the next system parameter change is not written twice
+      self._written[self.CH423_CMD_SET_SYSTEM_ARGS] = self._args
+
+  def get_activity(self):
+    '''!
+      @brief  Get the number of bus transactions of the driver so far, lock-free. Calls whose writes are all skipped do not count.
+      @return Transaction count, only its changes are meaningful
+    '''
+    return self._activity
+
+  @_locked
+  def sleep_if_idle(self, activity):
+    '''!
+      @brief  Enter sleep mode, unless the driver accessed the bus since get_activity() returned activity
+      @n  or the chip scans a display, which sleep would blank
+      @param activity  Value returned by get_activity()
+      @return Transaction count after the sleep command, None if the chip was not put to sleep
+    '''
+    if self._activity != activity:
+      return None
+    if self._args & ((1 << self.ARGS_BIT_DEC_L) | (1 << self.ARGS_BIT_DEC_H)):
+      return None
+    self.sleep()
+    return self._activity
+
+  @_locked
+  def display_mode(self, digits, dim = False):
+    '''!
+      @brief  Let the chip scan a multiplexed LED / 7-segment display by itself. GPIO0~GPIO7 drive the segments and GPO0~GPO15
+      @n  drive the digit commons, the chip refreshes the digits from its display data, so no software multiplexing is needed.
+      @param digits  Number of scanned digits
+      @n     0     Display scan off, GPO pins return to normal output, GPIO mode, latch and interrupt return to their state before the display
+      @n     8     Scan DIG0~DIG7 on GPO0~GPO7, GPO8~GPO15 stay normal outputs
+      @n     16    Scan DIG0~DIG15 on GPO0~GPO15
+      @param dim     True for the low brightness display drive, default to be False
+      @return Number of digits scanned. The GPIO pins drive the segments, so GPIO interrupt is suspended while the display
+      @n  scans and enabled again by display_mode(0); enable_interrupt() and disable_interrupt() only change that saved state meanwhile.
+    '''
+    if digits not in (0, 8, 16):
+      print("digits argument error, should be 0, 8 or 16.")
+      return None
+    io_en  = 1 << self.ARGS_BIT_IO_EN
+    int_en = 1 << self.ARGS_BIT_INT_EN
+    if digits and self._display_saved is None:
+      # GPIO mode, latch and interrupt from before the display, DIG0 shares the latch
+      self._display_saved = (self._args & io_en, self._gpio, self._args & int_en)
+      self._args &= ~int_en
+    self._args &= ~((1 << self.ARGS_BIT_DEC_L) | (1 << self.ARGS_BIT_DEC_H) | (1 << self.ARGS_BIT_INTENS)) & 0xFF
+    with self.batch():
+      if digits:
+        self._args |= io_en | (1 << self.ARGS_BIT_DEC_L)
+      elif self._display_saved is not None:
+        self._args = (self._args & ~(io_en | int_en)) | self._display_saved[0] | self._display_saved[2]
+        self._gpio = self._display_saved[1]
+        self._display_saved = None
+        self._write_reg(self.CH423_CMD_SET_GPIO, self._gpio)
+      if digits == 16:
+        self._args |= 1 << self.ARGS_BIT_DEC_H
+      if dim:
+        self._args |= 1 << self.ARGS_BIT_INTENS
+      self._set_system_args()
+    return digits
+
+  @_locked
+  def display_write(self, segments, start = 0):
+    '''!
+      @brief  Upload display data in one bulk update, only the digits whose data changed are written
+      @param segments  Segment byte of each digit, bit0~bit7 drive GPIO0~GPIO7 (segment a~g and dp), see SEG_FONT
+      @param start     First digit to write, 0~15, default to be 0
+    '''
+    segments = list(segments)
+    if start < 0 or start + len(segments) > 16:
+      print("digit argument range(0~15) error.")
+      return None
+    with self.batch():
+      for i, seg in enumerate(segments):
+        digit = start + i
+        if digit == 0:
+          self._gpio = seg & 0xFF
+        self._write_reg(self.CH423_CMD_SET_DIG0 + digit, seg & 0xFF)
+
+  def display_text(self, text, start = 0):
+    '''!
+      @brief  Show hexadecimal digits, spaces and '-' on a 7-segment display, a '.' lights the decimal point of the digit before it
+      @param text   String such as "12.34" or "AbC-"
+      @param start  First digit to write, default to be 0
+    '''
+    segments = []
+    for ch in str(text):
+      if ch == '.' and segments:
+        segments[-1] |= 0x80
+      elif ch == ' ':
+        segments.append(0x00)
+      elif ch == '-':
+        segments.append(0x40)
+      elif ch in "0123456789abcdefABCDEF":
+        segments.append(self.SEG_FONT[int(ch, 16)])
+      else:
+        print("text argument error, only 0~9, A~F, ' ', '-' and '.' can be shown.")
+        return None
+    self.display_write(segments, start)
+
+  @contextmanager
+  def batch(self):
+    '''!
+      @brief  Coalesce pin and mode changes. Inside "with ch423.batch():" gpio_digital_write, gpo_digital_write, group_digital_write,
+      @n  pin_mode and the other setters only update the driver state; when the block exits, every register that changed is written
+      @n  once, so a burst of updates costs at most four writes (GPIO, GPO_L, GPO_H and system parameters).
+      @note The GPIO/GPO levels are written before the system parameters, so outputs and the interrupt reference are valid before they
+      @n  are enabled. When GPIO switches from output to input, the system parameters are written first so the old outputs never see the new levels.
+      @n  Batches can be nested, the registers are written when the outermost one exits.
+      @n  The bus lock is held for the whole block, other threads see either none or all of its changes.
+    '''
+    with self._lock:
+      if self._batch_depth == 0:
+        self._batch_args = self._args
+      self._batch_depth += 1
+      try:
+        yield self
+      finally:
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+          self._flush()
+        self._publish()
+
   def gpio_pin_description(self, gpio):
     '''!
       @brief  Describe GPIO pins
@@ -528,9 +942,242 @@ class DFRobot_CH423:
       return ""
    
 
-  def _set_system_args(self):
-    self._bus.write_byte(self.CH423_CMD_SET_SYSTEM_ARGS, self._args)
+  def get_skipped_writes(self):
+    '''!
+      @brief  Get the number of register writes skipped because the register already held the value
+      @return Number of skipped writes
+    '''
+    return self._skipped
+
+  def set_retry(self, retries = 2, backoff = 0.001, max_backoff = 0.05):
+    '''!
+      @brief  Set how bus errors are handled. After a failed transaction the driver waits, pushes its whole known state to the
+      @n  chip (system parameters, GPO_L, GPO_H, then the GPIO latch / interrupt reference and display digits) in one combined write
+      @n  and repeats a failed read, because a bus error often means the chip was reset. The error is raised when every retry failed.
+      @param retries      Number of retries, 0 raises the first error, default to be 2
+      @param backoff      Wait before the first retry in seconds, doubled for every further retry, default to be 0.001
+      @param max_backoff  Longest wait between retries in seconds, default to be 0.05
+    '''
+    self._retries     = retries
+    self._backoff     = backoff
+    self._max_backoff = max_backoff
+
+  @_locked
+  def restore_state(self):
+    '''!
+      @brief  Push the whole known state to the chip in one combined write, for example after the application saw a power glitch
+    '''
+    self._restore()
+
+  def get_recovery_stats(self):
+    '''!
+      @brief  Get bus error and recovery statistics
+      @return dict with errors (failed transactions), retries, recoveries (errors recovered), failed (errors raised after the last retry),
+      @n  restore_writes (registers written by state restores), max_time and avg_time (seconds from the error to the restored state)
+    '''
+    recoveries = self._recoveries
+    return {"errors": self._bus_errors, "retries": self._retry_count, "recoveries": recoveries, "failed": self._failed_recoveries,
+            "restore_writes": self._restore_writes, "max_time": self._max_recovery_time,
+            "avg_time": self._recovery_time / recoveries if recoveries else 0.0}
+
+  def reset_recovery_stats(self):
+    '''!
+      @brief  Clear the bus error and recovery statistics
+    '''
+    self._bus_errors        = 0
+    self._retry_count       = 0
+    self._recoveries        = 0
+    self._failed_recoveries = 0
+    self._restore_writes    = 0
+    self._recovery_time     = 0.0
+    self._max_recovery_time = 0.0
+
+  ## Public methods counted by enable_stats()
+  STATS_METHODS = ("begin", "resync", "pin_mode", "gpio_digital_write", "gpo_digital_write", "group_digital_write", "write_masked",
+                   "set_mask", "clear_mask", "toggle_mask", "gpio_digital_read", "gpio_attach_interrupt", "enable_interrupt",
+                   "disable_interrupt", "poll_interrupts", "sleep", "display_mode", "display_write", "display_text")
+
+  def enable_stats(self):
+    '''!
+      @brief  Count the bus transactions and public method calls of this driver. The transport is wrapped in a CH423BusMonitor
+      @n  and the methods in STATS_METHODS get a counting wrapper; when stats are disabled neither is in the call path.
+      @n  Calls made by other driver methods are counted too, e.g. set_mask() also counts a write_masked() call.
+      @return CH423BusMonitor object
+    '''
+    with self._lock:
+      if self._stats is None:
+        self._stats = CH423BusMonitor(self._bus)
+        self._bus   = self._stats
+        for name in self.STATS_METHODS:
+          setattr(self, name, self._stats.count_calls(name, getattr(self, name)))
+      return self._stats
+
+  def disable_stats(self):
+    '''!
+      @brief  Remove the bus monitor and the method counters
+    '''
+    with self._lock:
+      if self._stats is not None:
+        self._unwrap(self._stats)
+        self._stats = None
+        for name in self.STATS_METHODS:
+          delattr(self, name)
+
+  def get_stats(self):
+    '''!
+      @brief  Get a snapshot of the bus and method statistics, see CH423BusMonitor.get_stats()
+      @return dict, None if stats are not enabled
+    '''
+    stats = self._stats
+    return stats.get_stats() if stats is not None else None
+
+  def reset_stats(self):
+    '''!
+      @brief  Clear the bus and method statistics
+    '''
+    stats = self._stats
+    if stats is not None:
+      stats.reset_stats()
+
+  def start_trace(self, path, buffer_size = 4096):
+    '''!
+      @brief  Record every bus operation of this driver into a trace file, see CH423TraceRecorder
+      @param path         Trace file
+      @param buffer_size  Bytes collected before they are written to the file, default to be 4096
+      @return CH423TraceRecorder object
+    '''
+    with self._lock:
+      self.stop_trace()
+      self._trace = CH423TraceRecorder(self._bus, path, buffer_size)
+      self._bus   = self._trace
+      return self._trace
+
+  def stop_trace(self):
+    '''!
+      @brief  Stop recording and flush the trace file
+    '''
+    with self._lock:
+      if self._trace is not None:
+        self._unwrap(self._trace)
+        self._trace.stop()
+        self._trace = None
+
+  def _unwrap(self, wrapper):
+    # remove a transport wrapper from the chain starting at self._bus, other wrappers may sit on top of it
+    if self._bus is wrapper:
+      self._bus = wrapper.transport
+      return
+    outer = self._bus
+    while outer.transport is not wrapper:
+      outer = outer.transport
+    outer.transport = wrapper.transport
+
+  def _write_reg(self, cmd, value, force = False):
+    if self._batch_depth:
+      self._pending[cmd] = value
+      if force:
+        self._forced.add(cmd)
+      return
+    if not force and self._written.get(cmd) == value:
+      self._skipped += 1
+      return
+    try:
+      self._bus.write_byte(cmd, value)
+    except (IOError, OSError) as e:
+      self._recover(e, ((cmd, value),))
+    self._written[cmd] = value
+    self._activity += 1
+
+  def _flush(self):
+    pending = self._pending
+    forced  = self._forced
+    if not pending:
+      return
+    self._pending = {}
+    self._forced  = set()
+    for cmd in list(pending):
+      if cmd not in forced and self._written.get(cmd) == pending[cmd]:
+        self._skipped += 1
+        del pending[cmd]
+    io_en = 1 << self.ARGS_BIT_IO_EN
+    writes = []
+    args = pending.pop(self.CH423_CMD_SET_SYSTEM_ARGS, None)
+    if args is not None and (self._batch_args & io_en) and not (args & io_en):
+      writes.append((self.CH423_CMD_SET_SYSTEM_ARGS, args))
+      args = None
+    for cmd in sorted(pending):
+      writes.append((cmd, pending[cmd]))
+    if args is not None:
+      writes.append((self.CH423_CMD_SET_SYSTEM_ARGS, args))
+    try:
+      if len(writes) == 1:
+        self._bus.write_byte(writes[0][0], writes[0][1])
+      elif writes:
+        self._bus.write_bytes(writes)
+    except (IOError, OSError) as e:
+      self._recover(e, writes)
+    for cmd, value in writes:
+      self._written[cmd] = value
+    if writes:
+      self._activity += 1
+
+  def _set_system_args(self, force = False):
+    self._write_reg(self.CH423_CMD_SET_SYSTEM_ARGS, self._args, force)
   
   def _read_gpio(self):
-     rslt = self._bus.read_byte(self.CH423_CMD_READ_GPIO)
-     return rslt
+    with self._lock:
+      try:
+        rslt = self._bus.read_byte(self.CH423_CMD_READ_GPIO)
+      except (IOError, OSError) as e:
+        rslt = self._recover(e, (), self.CH423_CMD_READ_GPIO)
+      self._activity += 1
+    return rslt
+
+  def _recover(self, error, writes, read_cmd = None):
+    # the chip may have been reset, so every retry pushes the whole known state again before repeating a read
+    start = monotonic()
+    self._bus_errors += 1
+    delay = self._backoff
+    for attempt in range(self._retries):
+      time.sleep(delay)
+      delay = min(delay * 2, self._max_backoff)
+      self._retry_count += 1
+      try:
+        self._restore(writes)
+        value = self._bus.read_byte(read_cmd) if read_cmd is not None else None
+      except (IOError, OSError) as e:
+        self._bus_errors += 1
+        error = e
+        continue
+      elapsed = monotonic() - start
+      self._recoveries    += 1
+      self._recovery_time += elapsed
+      if elapsed > self._max_recovery_time:
+        self._max_recovery_time = elapsed
+      return value
+    self._failed_recoveries += 1
+    raise error
+
+  def _restore(self, writes = ()):
+    state = {
+      self.CH423_CMD_SET_SYSTEM_ARGS: self._args,
+      self.CH423_CMD_SET_GPO_L:       self._gpo0_7,
+      self.CH423_CMD_SET_GPO_H:       self._gpo8_15,
+      self.CH423_CMD_SET_GPIO:        self._gpio,
+    }
+    state.update(self._written)
+    state.update(writes)
+    order = [self.CH423_CMD_SET_SYSTEM_ARGS, self.CH423_CMD_SET_GPO_L, self.CH423_CMD_SET_GPO_H]
+    order.extend(sorted(cmd for cmd in state if cmd >= self.CH423_CMD_SET_GPIO))
+    if state[self.CH423_CMD_SET_SYSTEM_ARGS] & (1 << self.ARGS_BIT_SLEEP):
+      # any later write would wake the chip again
+      order.append(order.pop(0))
+    writes = [(cmd, state[cmd]) for cmd in order]
+    self._bus.write_bytes(writes)
+    self._restore_writes += len(writes)
+    self._activity += 1
+    for cmd, value in writes:
+      self._written[cmd] = value
+
+  def _publish(self):
+    self._snapshot = (self._gpio | (self._gpo0_7 << 8) | (self._gpo8_15 << 16), self._args, self._int_value)
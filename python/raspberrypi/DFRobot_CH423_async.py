@@ -0,0 +1,219 @@
+# -*- coding:utf-8 -*-
+
+'''!
+  @file DFRobot_CH423_async.py
+  @brief asyncio front-end of DFRobot_CH423 (Python 3 only). Every bus operation runs on a dedicated I/O worker thread,
+  @n in the order it was requested, so the event loop never blocks on the I2C bus. Writes queued back to back are
+  @n executed inside one DFRobot_CH423.batch(), so each register changed by them is written once.
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import time
+import asyncio
+import threading
+import collections
+
+from DFRobot_CH423_interrupt import CH423InterruptDispatcher
+
+## Interrupt event delivered by AsyncCH423.events(), pin is the GPIO pin 0~7, timestamp the monotonic time of the poll
+InterruptEvent = collections.namedtuple("InterruptEvent", "pin timestamp")
+
+
+class CH423Worker(object):
+  '''!
+    @brief I/O worker thread running driver calls in request order. One worker can serve several AsyncCH423 objects,
+    @n so many boards can be driven from one event loop without a thread per device.
+  '''
+  def __init__(self):
+    self._queue  = collections.deque()
+    self._cond   = threading.Condition()
+    self._closed = False
+    self._thread = threading.Thread(target = self._run, name = "CH423Worker")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, dev, name, args, kwargs, write):
+    '''!
+      @brief Queue a driver call
+      @param dev    DFRobot_CH423 object
+      @param name   Method name
+      @param write  True if the call only changes registers and may be merged with neighbouring writes
+      @return asyncio future of the call result
+    '''
+    loop = asyncio.get_running_loop()
+    fut  = loop.create_future()
+    with self._cond:
+      if self._closed:
+        raise RuntimeError("CH423Worker is closed")
+      self._queue.append((dev, name, args, kwargs, write, loop, fut))
+      self._cond.notify()
+    return fut
+
+  def close(self):
+    '''!
+      @brief Stop the worker thread after the queued calls are done
+    '''
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    if self._thread is not threading.current_thread():
+      self._thread.join()
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while not self._queue and not self._closed:
+          self._cond.wait()
+        if not self._queue:
+          return
+        items = list(self._queue)
+        self._queue.clear()
+      i = 0
+      while i < len(items):
+        dev, write = items[i][0], items[i][4]
+        j = i + 1
+        if write:
+          while j < len(items) and items[j][4] and items[j][0] is dev:
+            j += 1
+        self._execute(dev, items[i:j], write)
+        i = j
+
+  def _execute(self, dev, items, write):
+    results = []
+    try:
+      if write and len(items) > 1:
+        with dev.batch():
+          for item in items:
+            results.append(self._call(item))
+      else:
+        for item in items:
+          results.append(self._call(item))
+    except Exception as e:
+      # the batch flush failed, every merged write shares the error
+      results = [(None, e)]*len(items)
+    for item, (result, error) in zip(items, results):
+      loop, fut = item[5], item[6]
+      loop.call_soon_threadsafe(self._resolve, fut, result, error)
+
+  @staticmethod
+  def _call(item):
+    dev, name, args, kwargs = item[:4]
+    try:
+      return (getattr(dev, name)(*args, **kwargs), None)
+    except Exception as e:
+      return (None, e)
+
+  @staticmethod
+  def _resolve(fut, result, error):
+    if fut.cancelled():
+      return
+    if error is not None:
+      fut.set_exception(error)
+    else:
+      fut.set_result(result)
+
+
+class AsyncCH423(object):
+  '''!
+    @brief Awaitable wrapper of DFRobot_CH423, every driver method is available as a coroutine:
+    @n   await dev.gpo_digital_write(dev.eGPO0, 1)
+    @n   async for event in dev.events(): ...
+    @n Methods that would block the event loop, such as batch(), are not forwarded, use dev.dev from another thread for them.
+  '''
+  ## Methods that only change registers, queued writes of these are merged
+  WRITE_METHODS = frozenset(("pin_mode", "gpio_digital_write", "gpo_digital_write", "group_digital_write",
+                             "write_masked", "set_mask", "clear_mask", "toggle_mask", "display_write", "display_text"))
+  ## Methods that read the bus or must not be merged
+  CALL_METHODS  = frozenset(("begin", "resync", "gpio_digital_read", "enable_interrupt", "disable_interrupt",
+                             "poll_interrupts", "sleep", "display_mode"))
+
+  def __init__(self, dev, worker = None, max_events = 1024, source = None):
+    '''!
+      @param dev         DFRobot_CH423 object
+      @param worker      CH423Worker shared with other devices, default to be a new worker owned by this object
+      @param max_events  Size of the event queue read by events(), the oldest events are dropped when it is full
+      @param source      CH423EdgeSource of the GPO15/INT line, such as CH423GPIOChipEdgeSource; a CH423InterruptDispatcher
+      @n                 owned by this object then polls the interrupts. Default to be None, the caller has to await poll_interrupts()
+    '''
+    self.dev        = dev
+    self._own       = worker is None
+    self._worker    = worker if worker is not None else CH423Worker()
+    self._events    = collections.deque(maxlen = max_events)
+    self._waiters   = []
+    self._loop      = None
+    self.dropped_events = 0
+    self._dispatcher    = None
+    if source is not None:
+      self._dispatcher = CH423InterruptDispatcher(dev, source)
+      self._dispatcher.start()
+
+  def __getattr__(self, name):
+    if name in self.WRITE_METHODS or name in self.CALL_METHODS:
+      write = name in self.WRITE_METHODS
+      async def call(*args, **kwargs):
+        return await self._worker.submit(self.dev, name, args, kwargs, write)
+      call.__name__ = name
+      return call
+    # constants such as eGPO0 come from the driver, its other methods would block the event loop
+    attr = getattr(self.dev, name)
+    if callable(attr):
+      raise AttributeError("%s() blocks on the bus and is not available on AsyncCH423, call dev.dev.%s() from another thread"%(name, name))
+    return attr
+
+  async def gpio_attach_interrupt(self, gpio, mode, callback = None):
+    '''!
+      @brief Set the interrupt mode of GPIO pins, the interrupts found by poll_interrupts() are delivered through events()
+      @param gpio      eGPIO0~eGPIO7 or eGPIO_TOTAL
+      @param mode      eLOW, eHIGH, eRISING, eFALLING or eCHANGE
+      @param callback  Optional function also called as callback(pin) on the thread running poll_interrupts()
+    '''
+    self._loop = asyncio.get_running_loop()
+    def notify(pin):
+      self._loop.call_soon_threadsafe(self._push, InterruptEvent(pin, time.monotonic()))
+      if callback:
+        callback(pin)
+    return await self._worker.submit(self.dev, "gpio_attach_interrupt", (gpio, mode, notify), {}, False)
+
+  async def events(self):
+    '''!
+      @brief Async iterator of InterruptEvent, fed by poll_interrupts(). Nothing arrives unless something polls: pass an edge
+      @n source to the constructor, or await poll_interrupts() yourself.
+    '''
+    while True:
+      while self._events:
+        yield self._events.popleft()
+      fut = asyncio.get_running_loop().create_future()
+      self._waiters.append(fut)
+      try:
+        await fut
+      finally:
+        if fut in self._waiters:
+          self._waiters.remove(fut)
+
+  async def aclose(self):
+    '''!
+      @brief Stop the interrupt dispatcher, and the worker thread if this object owns it
+    '''
+    loop = asyncio.get_running_loop()
+    if self._dispatcher is not None:
+      await loop.run_in_executor(None, self._dispatcher.stop)
+      self._dispatcher = None
+    if self._own:
+      await loop.run_in_executor(None, self._worker.close)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, exc_type, exc, tb):
+    await self.aclose()
+
+  def _push(self, event):
+    if len(self._events) == self._events.maxlen:
+      self.dropped_events += 1
+    self._events.append(event)
+    waiters, self._waiters = self._waiters, []
+    for fut in waiters:
+      if not fut.done():
+        fut.set_result(None)
@@ -0,0 +1,21 @@
+# -*- coding:utf-8 -*-
+
+'''!
+  @file DFRobot_CH423_compat.py
+  @brief Clock functions shared by the DFRobot_CH423 modules, for Python 2 as well as Python 3
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import time
+
+## Monotonic time in seconds, falls back to time.time() where time.monotonic() does not exist (Python 2)
+monotonic = getattr(time, "monotonic", time.time)
+
+if hasattr(time, "monotonic_ns"):
+  ## Monotonic time in ns
+  monotonic_ns = time.monotonic_ns
+else:
+  def monotonic_ns():
+    return int(monotonic() * 1000000000)
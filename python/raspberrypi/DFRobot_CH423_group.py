@@ -0,0 +1,191 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_group.py
+  @brief Drive several CH423 boards on separate I2C buses, one worker thread per board
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import threading
+import collections
+
+from DFRobot_CH423 import DFRobot_CH423
+
+
+class _CH423Call(object):
+  def __init__(self, func, args):
+    self.func   = func
+    self.args   = args
+    self.done   = threading.Event()
+    self.result = None
+    self.error  = None
+
+  def wait(self):
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.result
+
+
+class _CH423BusWorker(object):
+  def __init__(self, name):
+    self._queue  = collections.deque()
+    self._cond   = threading.Condition()
+    self._closed = False
+    self._thread = threading.Thread(target = self._run, name = name)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def submit(self, func, *args):
+    call = _CH423Call(func, args)
+    with self._cond:
+      self._queue.append(call)
+      self._cond.notify()
+    return call
+
+  def close(self):
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._thread.join()
+
+  def _run(self):
+    while True:
+      with self._cond:
+        while not self._queue and not self._closed:
+          self._cond.wait()
+        if not self._queue:
+          return
+        call = self._queue.popleft()
+      try:
+        call.result = call.func(*call.args)
+      except Exception as e:
+        call.error = e
+      call.done.set()
+
+
+class CH423Group(object):
+  '''!
+    @brief Drive several CH423 boards, one per I2C bus, under one global pin namespace. Every board has its own worker
+    @n thread, so the writes to different buses go out in parallel.
+    @n Global pin n is bit (n % 24) of board n / 24, in the 24-bit layout of write_masked (GPIO0~GPIO7, then GPO0~GPO15),
+    @n so a global mask is a Python integer with 24 bits per board.
+  '''
+  ## Output lines per board
+  PINS = 24
+
+  def __init__(self, devices):
+    '''!
+      @param devices  List of DFRobot_CH423 objects or I2C bus numbers, board 0 first
+    '''
+    self.devices  = [DFRobot_CH423(bus = d) if isinstance(d, int) else d for d in devices]
+    self._own     = [isinstance(d, int) for d in devices]
+    self._workers = [_CH423BusWorker("CH423Group-%d"%i) for i in range(len(self.devices))]
+
+  def __len__(self):
+    return len(self.devices)
+
+  def begin(self, gpio_mode = DFRobot_CH423.eINPUT, gpo_mode = DFRobot_CH423.ePUSH_PULL):
+    '''!
+      @brief Init every board, see DFRobot_CH423.begin()
+      @return List of the results of the boards
+    '''
+    return self.call_all("begin", gpio_mode, gpo_mode)
+
+  def call_all(self, name, *args):
+    '''!
+      @brief Call a driver method on every board in parallel and wait for all of them
+      @param name  Method name, such as "pin_mode"
+      @return List of the results, board 0 first
+    '''
+    calls = [w.submit(getattr(d, name), *args) for d, w in zip(self.devices, self._workers)]
+    return [c.wait() for c in calls]
+
+  def pin_write(self, pin, level):
+    '''!
+      @brief Set the level of one global pin
+      @param pin    Global pin number
+      @param level  1 or 0
+    '''
+    board, bit = divmod(pin, self.PINS)
+    self._workers[board].submit(self.devices[board].write_masked, 1 << bit, (1 << bit) if level else 0).wait()
+
+  def write_masked(self, mask, value, wait = True):
+    '''!
+      @brief Set several global pins at once, every board whose part of the mask is not empty is written in parallel
+      @param mask   Global pin mask, 24 bits per board
+      @param value  Global levels for the pins selected by mask
+      @param wait   True to return after all boards are written, default to be True
+    '''
+    calls = []
+    board = 0
+    while mask and board < len(self.devices):
+      m = mask & DFRobot_CH423.MASK_ALL
+      if m:
+        calls.append(self._workers[board].submit(self.devices[board].write_masked, m, value & m))
+      mask  >>= self.PINS
+      value >>= self.PINS
+      board  += 1
+    if wait:
+      for c in calls:
+        c.wait()
+
+  def set_mask(self, mask, wait = True):
+    '''!
+      @brief Set several global pins to level 1
+    '''
+    self.write_masked(mask, mask, wait)
+
+  def clear_mask(self, mask, wait = True):
+    '''!
+      @brief Set several global pins to level 0
+    '''
+    self.write_masked(mask, 0, wait)
+
+  def write_all(self, value, wait = True):
+    '''!
+      @brief Write the same 24-bit value to every board
+    '''
+    mask = 0
+    data = 0
+    for i in range(len(self.devices)):
+      mask |= DFRobot_CH423.MASK_ALL << (i * self.PINS)
+      data |= (value & DFRobot_CH423.MASK_ALL) << (i * self.PINS)
+    self.write_masked(mask, data, wait)
+
+  def get_outputs(self):
+    '''!
+      @brief Output levels of all boards as last written
+      @return Global pin levels, 24 bits per board
+    '''
+    value = 0
+    for i, d in enumerate(self.devices):
+      value |= d.get_outputs() << (i * self.PINS)
+    return value
+
+  def read_inputs(self):
+    '''!
+      @brief Read GPIO0~GPIO7 of every board in parallel
+      @return List of the level bytes, board 0 first
+    '''
+    return self.call_all("gpio_digital_read", DFRobot_CH423.eGPIO_TOTAL)
+
+  def close(self):
+    '''!
+      @brief Stop the worker threads and release the buses of the boards created from bus numbers
+    '''
+    for w in self._workers:
+      w.close()
+    for d, own in zip(self.devices, self._own):
+      if own:
+        d.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.close()
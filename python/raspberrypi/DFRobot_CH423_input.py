@@ -0,0 +1,483 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_input.py
+  @brief GPIO input processing of DFRobot_CH423: debouncer, high-rate sampler and edge counter
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import math
+import array
+import binascii
+import threading
+import collections
+
+from DFRobot_CH423 import DFRobot_CH423
+from DFRobot_CH423_compat import monotonic, monotonic_ns
+
+try:
+  array.array('Q')
+  _ARRAY_U64 = 'Q'
+except ValueError:
+  _ARRAY_U64 = 'L'
+if hasattr(int, "from_bytes"):
+  def _bytes_to_int(data):
+    return int.from_bytes(data, "big")
+else:
+  def _bytes_to_int(data):
+    return int(binascii.hexlify(data), 16) if data else 0
+
+class CH423Debouncer(object):
+  '''!
+    @brief Integrating debouncer for GPIO0~GPIO7. A pin only changes its debounced level after its raw level differed
+    @n for the configured number of consecutive samples. All 8 pins are processed at once with 4-bit vertical counters
+    @n (one byte per counter bit), so an update costs the same few bitwise operations whatever the number of bouncing pins.
+  '''
+  ## Largest number of samples a pin can be configured to
+  MAX_SAMPLES = 15
+
+  def __init__(self, samples = 4, interval = 0.001, max_samples = 64):
+    '''!
+      @param samples      Consecutive differing samples needed to accept a change on every pin, 1~15, default to be 4
+      @param interval     Time between samples while poll_interrupts() waits for bouncing pins to settle, default to be 1ms
+      @param max_samples  Most extra samples poll_interrupts() takes while pins are still bouncing, default to be 64
+    '''
+    self.interval    = interval
+    self.max_samples = max_samples
+    self._thresh     = [0]*8
+    self._t          = [0, 0, 0, 0]
+    self._c          = [0, 0, 0, 0]
+    self._stable     = None
+    for gpio in range(8):
+      self.set_samples(gpio, samples)
+
+  def set_samples(self, gpio, samples):
+    '''!
+      @brief Set the number of consecutive differing samples a pin needs to change level
+      @param gpio     GPIO pin, eGPIO0~eGPIO7, or eGPIO_TOTAL for all pins
+      @param samples  1~15, 1 turns debouncing off for the pin
+    '''
+    samples = min(max(int(samples), 1), self.MAX_SAMPLES)
+    pins = range(8) if gpio == DFRobot_CH423.eGPIO_TOTAL else (gpio,)
+    for pin in pins:
+      self._thresh[pin] = samples
+    t = [0, 0, 0, 0]
+    for pin in range(8):
+      for k in range(4):
+        if (self._thresh[pin] >> k) & 1:
+          t[k] |= 1 << pin
+    self._t = t
+
+  def set_time(self, gpio, seconds):
+    '''!
+      @brief Set the debounce time of a pin, converted to samples of the configured interval
+      @param gpio     GPIO pin, eGPIO0~eGPIO7, or eGPIO_TOTAL for all pins
+      @param seconds  Time the raw level has to stay changed
+    '''
+    self.set_samples(gpio, int(math.ceil(seconds / self.interval)))
+
+  def reset(self, level = None):
+    '''!
+      @brief Forget the counters, the next update takes its raw level as debounced level unless level is given
+    '''
+    self._c      = [0, 0, 0, 0]
+    self._stable = level
+
+  @property
+  def pending(self):
+    '''!
+      @brief Mask of the pins whose raw level differs from the debounced level and is still being counted
+    '''
+    c = self._c
+    return c[0] | c[1] | c[2] | c[3]
+
+  @property
+  def level(self):
+    '''!
+      @brief Debounced level of GPIO0~GPIO7
+    '''
+    return self._stable
+
+  def update(self, raw):
+    '''!
+      @brief Feed one raw sample of GPIO0~GPIO7
+      @param raw  Raw level byte
+      @return Debounced level byte
+    '''
+    stable = self._stable
+    if stable is None:
+      self._stable = raw
+      return raw
+    delta = (raw ^ stable) & 0xFF
+    c0, c1, c2, c3 = self._c
+    t0, t1, t2, t3 = self._t
+    # counters of pins back at the debounced level restart from 0, the others count up
+    c0 &= delta
+    c1 &= delta
+    c2 &= delta
+    c3 &= delta
+    carry = delta & c0
+    c0 ^= delta
+    c1 ^= carry
+    carry &= ~c1
+    c2 ^= carry
+    carry &= ~c2
+    c3 ^= carry
+    reached = delta & ~((c0 ^ t0) | (c1 ^ t1) | (c2 ^ t2) | (c3 ^ t3)) & 0xFF
+    if reached:
+      stable ^= reached
+      keep = ~reached
+      c0 &= keep
+      c1 &= keep
+      c2 &= keep
+      c3 &= keep
+      self._stable = stable
+    self._c = [c0, c1, c2, c3]
+    return stable
+
+
+class CH423SampleBlock(object):
+  '''!
+    @brief Block of GPIO samples filled by CH423Sampler. Only the first length entries of levels and timestamps are valid.
+  '''
+  def __init__(self, size):
+    self.levels     = array.array('B', bytes(bytearray(size)))
+    self.timestamps = array.array(_ARRAY_U64, [0]) * size
+    self.length     = 0
+    self.seq        = 0
+
+
+class CH423Sampler(object):
+  '''!
+    @brief Sample GPIO0~GPIO7 as fast as the bus allows on a dedicated thread, like a logic analyzer. Samples go into
+    @n preallocated blocks of levels (array('B')) with monotonic timestamps in ns, handed out by blocks().
+  '''
+  def __init__(self, dev, block_size = 4096, blocks = 8, changes_only = False):
+    '''!
+      @param dev           DFRobot_CH423 object
+      @param block_size    Samples per block, default to be 4096
+      @param blocks        Number of preallocated blocks, default to be 8
+      @param changes_only  True to store a sample only when the level changed (run-length compression), default to be False
+    '''
+    self._dev          = dev
+    self._changes_only = changes_only
+    self._blocks       = [CH423SampleBlock(block_size) for i in range(blocks)]
+    self._free         = collections.deque(self._blocks)
+    self._filled       = collections.deque()
+    self._cond         = threading.Condition()
+    self._stop         = threading.Event()
+    self._thread       = None
+    self._listeners    = []
+    self.reset_stats()
+
+  def start(self):
+    '''!
+      @brief Start sampling
+    '''
+    if self.is_running():
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target = self._run, name = "CH423Sampler")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    '''!
+      @brief Stop sampling, the block being filled is handed out as it is
+    '''
+    self._stop.set()
+    with self._cond:
+      self._cond.notify_all()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self._thread = None
+    with self._cond:
+      self._cond.notify_all()
+
+  def is_running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def blocks(self, timeout = None):
+    '''!
+      @brief Iterate over filled blocks. A block goes back to the sampler when the iteration moves on to the next one,
+      @n so copy the data you want to keep. The iteration ends when sampling stops and all blocks are taken,
+      @n or when no block arrives within timeout seconds.
+    '''
+    while True:
+      with self._cond:
+        deadline = None if timeout is None else monotonic() + timeout
+        while not self._filled and self.is_running():
+          remain = None if deadline is None else deadline - monotonic()
+          if remain is not None and remain <= 0:
+            break
+          self._cond.wait(remain)
+        if not self._filled:
+          return
+        block = self._filled.popleft()
+      try:
+        yield block
+      finally:
+        self.release(block)
+
+  def release(self, block):
+    '''!
+      @brief Give a block taken from blocks() back to the sampler
+    '''
+    with self._cond:
+      if block not in self._free:
+        self._free.append(block)
+        self._cond.notify_all()
+
+  def add_listener(self, callback):
+    '''!
+      @brief Register a function called as callback(block) on the sampler thread each time a block is filled,
+      @n before it is handed to blocks(). The block must not be kept after the callback returns.
+    '''
+    self._listeners.append(callback)
+
+  def get_stats(self):
+    '''!
+      @brief Get sampling statistics
+      @return dict with samples (bus reads), stored (samples stored), rate (reads per second), blocks (blocks filled),
+      @n dropped (filled blocks overwritten before being taken, or refilled because the consumer held all other blocks) and errors (failed reads)
+    '''
+    elapsed = self._elapsed
+    if self.is_running():
+      elapsed += monotonic() - self._started
+    return {"samples": self._samples, "stored": self._stored, "rate": self._samples / elapsed if elapsed > 0 else 0.0,
+            "blocks": self._filled_count, "dropped": self._dropped, "errors": self._errors}
+
+  def reset_stats(self):
+    self._samples      = 0
+    self._stored       = 0
+    self._filled_count = 0
+    self._dropped      = 0
+    self._errors       = 0
+    self._elapsed      = 0.0
+    self._started      = monotonic()
+
+  def _take_block(self):
+    with self._cond:
+      if self._free:
+        block = self._free.popleft()
+      elif self._filled:
+        block = self._filled.popleft()
+        self._dropped += 1
+      else:
+        # the consumer holds every other block
+        return None
+    block.length = 0
+    block.seq    = self._filled_count
+    return block
+
+  def _wait_block(self):
+    # the consumer may still hold every block from an earlier run, wait until it gives one back
+    with self._cond:
+      while not self._free and not self._filled and not self._stop.is_set():
+        self._cond.wait()
+      if self._stop.is_set():
+        return None
+      return self._take_block()
+
+  def _hand_out(self, block):
+    for callback in self._listeners:
+      callback(block)
+    with self._cond:
+      self._filled.append(block)
+      self._filled_count += 1
+      self._cond.notify_all()
+
+  def _run(self):
+    read     = self._dev.gpio_digital_read
+    total    = self._dev.eGPIO_TOTAL
+    clock    = monotonic_ns
+    stop     = self._stop
+    changes  = self._changes_only
+    block    = self._wait_block()
+    if block is None:
+      return
+    levels   = block.levels
+    stamps   = block.timestamps
+    size     = len(levels)
+    n        = 0
+    last     = -1
+    samples  = 0
+    self._started = monotonic()
+    while not stop.is_set():
+      try:
+        level = read(total)
+      except (IOError, OSError):
+        self._errors += 1
+        continue
+      stamp = clock()
+      samples += 1
+      self._samples = samples
+      if changes and level == last:
+        continue
+      last = level
+      levels[n] = level
+      stamps[n] = stamp
+      n += 1
+      if n == size:
+        n    = 0
+        free = self._take_block()
+        if free is None:
+          # no block to switch to, refill this one and count its samples as dropped
+          self._dropped += 1
+          continue
+        block.length = size
+        self._stored += size
+        self._hand_out(block)
+        block  = free
+        levels = block.levels
+        stamps = block.timestamps
+    self._elapsed += monotonic() - self._started
+    if n:
+      block.length = n
+      self._stored += n
+      self._hand_out(block)
+    else:
+      self.release(block)
+
+
+class CH423EdgeCounter(object):
+  '''!
+    @brief Edge counters and windowed frequency measurement of GPIO0~GPIO7, for flow meters, tachometers and the like.
+    @n Single samples are XORed with the previous one and the resulting edge masks are tallied in a 256-entry histogram, which
+    @n is folded into per-pin counters only when a window closes or a snapshot is taken. A block is XORed with itself shifted
+    @n by one sample as one big integer, and the edges of each pin are counted with one population count.
+    @n Feed it from CH423Sampler (sampler.add_listener(counter.feed_block)) or from poll_interrupts() (set_edge_counter()).
+  '''
+  def __init__(self, edge = DFRobot_CH423.eRISING, window = 1.0):
+    '''!
+      @param edge    Edges to count: eRISING, eFALLING or eCHANGE (both), default to be eRISING
+      @param window  Length of the frequency measurement window in seconds, default to be 1.0
+    '''
+    self._edge   = edge
+    self._window = int(window * 1000000000)
+    self._lock   = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    '''!
+      @brief Clear the counters and the frequency measurement
+    '''
+    with self._lock:
+      self._hist        = [0]*256
+      self._counts      = [0]*8
+      self._last        = None
+      self._win_start   = None
+      self._win_counts  = [0]*8
+      self._freqs       = [0.0]*8
+
+  def feed(self, level, timestamp_ns = None):
+    '''!
+      @brief Feed one sample
+      @param level         Level of GPIO0~GPIO7
+      @param timestamp_ns  Monotonic time of the sample in ns, default to be now
+    '''
+    if timestamp_ns is None:
+      timestamp_ns = monotonic_ns()
+    with self._lock:
+      last = self._last
+      if last is not None:
+        edges = self._edges(last, level)
+        if edges:
+          self._hist[edges] += 1
+      self._last = level
+      self._tick(timestamp_ns)
+
+  def feed_block(self, block):
+    '''!
+      @brief Feed a CH423SampleBlock, or any object with levels, timestamps and length
+    '''
+    n = block.length
+    if not n:
+      return
+    data = bytes(bytearray(block.levels[:n]))
+    with self._lock:
+      last = self._last
+      if last is None:
+        last = bytearray(data)[0]
+      if self._win_start is None:
+        self._win_start = block.timestamps[0]
+      # byte k of prev is sample k - 1, so cur ^ prev holds the edges of every sample at once
+      cur  = _bytes_to_int(data)
+      prev = _bytes_to_int(bytearray([last]) + data[:-1])
+      x    = cur ^ prev
+      if self._edge == DFRobot_CH423.eRISING:
+        x &= cur
+      elif self._edge == DFRobot_CH423.eFALLING:
+        x &= prev
+      if x:
+        ones   = _bytes_to_int(b"\x01" * n)
+        counts = self._counts
+        for i in range(8):
+          counts[i] += bin((x >> i) & ones).count("1")
+      self._last = bytearray(data)[-1]
+      self._tick(block.timestamps[n - 1])
+
+  def counts(self):
+    '''!
+      @brief Snapshot of the edge counters
+      @return List of 8 edge counts, for GPIO0~GPIO7
+    '''
+    with self._lock:
+      self._fold()
+      return list(self._counts)
+
+  def frequencies(self):
+    '''!
+      @brief Frequencies measured over the last complete window
+      @return List of 8 frequencies in Hz, for GPIO0~GPIO7 (eCHANGE counts two edges per cycle)
+      @note A window that ended since the last sample is closed here, so a signal that stopped (and stopped triggering polls)
+      @n  reads as a falling and then zero frequency instead of keeping its last value
+    '''
+    with self._lock:
+      self._tick(monotonic_ns())
+      return list(self._freqs)
+
+  def periods(self):
+    '''!
+      @brief Periods measured over the last complete window
+      @return List of 8 periods in seconds, None for pins without edges in the window
+    '''
+    return [1.0 / f if f else None for f in self.frequencies()]
+
+  def _edges(self, last, level):
+    x = last ^ level
+    if self._edge == DFRobot_CH423.eRISING:
+      x &= level
+    elif self._edge == DFRobot_CH423.eFALLING:
+      x &= ~level
+    return x & 0xFF
+
+  def _fold(self):
+    hist   = self._hist
+    counts = self._counts
+    for mask in range(1, 256):
+      n = hist[mask]
+      if n:
+        hist[mask] = 0
+        for i in range(8):
+          if (mask >> i) & 1:
+            counts[i] += n
+
+  def _tick(self, timestamp_ns):
+    if self._win_start is None:
+      self._win_start = timestamp_ns
+      return
+    elapsed = timestamp_ns - self._win_start
+    if elapsed < self._window:
+      return
+    self._fold()
+    per_cycle = 2.0 if self._edge == DFRobot_CH423.eCHANGE else 1.0
+    counts = self._counts
+    start  = self._win_counts
+    self._freqs = [(counts[i] - start[i]) * 1e9 / elapsed / per_cycle for i in range(8)]
+    self._win_counts = list(counts)
+    self._win_start  = timestamp_ns
@@ -0,0 +1,407 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_interrupt.py
+  @brief Interrupt handling of DFRobot_CH423: event ring, callback pool, GPO15/INT edge sources and the dispatcher thread
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import os
+import time
+import select
+import struct
+import threading
+import traceback
+import collections
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+from DFRobot_CH423_compat import monotonic
+
+class CH423EventRing(object):
+  '''!
+    @brief Preallocated ring buffer of interrupt records, filled by poll_interrupts() without creating objects per event.
+    @n Each record is RECORD: monotonic time in ns (uint64), mask of the fired pins (uint8) and level of GPIO0~GPIO7 (uint8),
+    @n padded to 16 bytes. When the ring is full the oldest records are overwritten.
+  '''
+  ## Layout of one record
+  RECORD = struct.Struct("<QBB6x")
+
+  def __init__(self, capacity = 4096):
+    '''!
+      @param capacity  Number of records the ring holds, default to be 4096
+    '''
+    self.capacity     = capacity
+    self._buf         = bytearray(self.RECORD.size * capacity)
+    self._view        = memoryview(self._buf)
+    self._lock        = threading.Lock()
+    self._head        = 0
+    self._count       = 0
+    self._appended    = 0
+    self._overwritten = 0
+
+  def __len__(self):
+    return self._count
+
+  def append(self, timestamp_ns, mask, level):
+    '''!
+      @brief Add a record
+      @param timestamp_ns  Monotonic time in ns
+      @param mask          Mask of the fired pins
+      @param level         Level of GPIO0~GPIO7
+    '''
+    with self._lock:
+      tail = self._head + self._count
+      if tail >= self.capacity:
+        tail -= self.capacity
+      self.RECORD.pack_into(self._buf, tail * self.RECORD.size, timestamp_ns, mask, level)
+      if self._count == self.capacity:
+        self._head += 1
+        if self._head == self.capacity:
+          self._head = 0
+        self._overwritten += 1
+      else:
+        self._count += 1
+      self._appended += 1
+
+  def drain(self, max_records = None):
+    '''!
+      @brief Take the oldest records out of the ring without copying them
+      @param max_records  Most records to take, default to be None (all records up to the end of the buffer)
+      @return memoryview of whole records in RECORD layout, empty when the ring is empty. The ring may wrap, so call
+      @n drain() until it returns an empty view to take everything. The view stays valid until the ring wraps over it,
+      @n copy it (bytes(view)) to keep it longer.
+    '''
+    with self._lock:
+      n = min(self._count, self.capacity - self._head)
+      if max_records is not None:
+        n = min(n, max_records)
+      start = self._head * self.RECORD.size
+      self._head += n
+      if self._head == self.capacity:
+        self._head = 0
+      self._count -= n
+    return self._view[start:start + n * self.RECORD.size]
+
+  def drain_numpy(self, max_records = None):
+    '''!
+      @brief Like drain(), but return a NumPy structured array with fields timestamp, mask and level (needs numpy)
+    '''
+    import numpy
+    dtype = numpy.dtype({"names": ["timestamp", "mask", "level"], "formats": ["<u8", "u1", "u1"],
+                         "offsets": [0, 8, 9], "itemsize": self.RECORD.size})
+    return numpy.frombuffer(self.drain(max_records), dtype = dtype)
+
+  @classmethod
+  def records(cls, view):
+    '''!
+      @brief Decode a drained view
+      @return List of (timestamp_ns, mask, level) tuples
+    '''
+    size = cls.RECORD.size
+    return [cls.RECORD.unpack_from(view, i) for i in range(0, len(view), size)]
+
+  def get_stats(self):
+    '''!
+      @brief Get ring statistics
+      @return dict with count (records waiting), appended (records ever added) and overwritten (records lost because the ring was full)
+    '''
+    return {"count": self._count, "appended": self._appended, "overwritten": self._overwritten}
+
+
+class CH423CallbackPool(object):
+  '''!
+    @brief Run interrupt callbacks on worker threads, so slow callbacks do not delay poll_interrupts().
+    @n Every pin is always served by the same worker, so the callbacks of one pin run in the order the interrupts fired.
+  '''
+  ## Queue full: drop the oldest queued event of the worker
+  DROP_OLDEST = 0
+  ## Queue full: drop the new event
+  DROP_NEWEST = 1
+  ## Queue full: wait in poll_interrupts() until the worker frees a slot
+  BLOCK       = 2
+
+  def __init__(self, workers = 2, queue_size = 64, overflow = DROP_OLDEST):
+    '''!
+      @param workers     Number of worker threads, default to be 2
+      @param queue_size  Events each worker can queue, default to be 64
+      @param overflow    What to do when a worker queue is full: DROP_OLDEST, DROP_NEWEST or BLOCK
+    '''
+    self._size     = queue_size
+    self._overflow = overflow
+    self._lock     = threading.Lock()
+    self._closed   = False
+    self._queues   = []
+    self._threads  = []
+    self._not_empty = []
+    self._not_full  = []
+    self._depth     = 0
+    self._max_depth = 0
+    self._dropped   = 0
+    self._errors    = 0
+    for i in range(workers):
+      self._queues.append(collections.deque())
+      self._not_empty.append(threading.Condition(self._lock))
+      self._not_full.append(threading.Condition(self._lock))
+      thread = threading.Thread(target = self._run, args = (i,), name = "CH423Callback-%d"%i)
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def submit(self, pin, callback):
+    '''!
+      @brief Queue callback(pin) on the worker of the pin
+      @return True if queued, False if the event was dropped
+    '''
+    i = pin % len(self._queues)
+    queue = self._queues[i]
+    with self._lock:
+      if self._closed:
+        return False
+      if len(queue) >= self._size:
+        if self._overflow == self.DROP_NEWEST:
+          self._dropped += 1
+          return False
+        elif self._overflow == self.DROP_OLDEST:
+          queue.popleft()
+          self._depth   -= 1
+          self._dropped += 1
+        else:
+          while len(queue) >= self._size and not self._closed:
+            self._not_full[i].wait()
+          if self._closed:
+            # the worker has exited, the event would never run
+            self._dropped += 1
+            return False
+      queue.append((callback, pin))
+      self._depth += 1
+      if self._depth > self._max_depth:
+        self._max_depth = self._depth
+      self._not_empty[i].notify()
+    return True
+
+  def get_stats(self):
+    '''!
+      @brief Get pool statistics
+      @return dict with depth (events queued now), max_depth, dropped and errors (callbacks that raised)
+    '''
+    return {"depth": self._depth, "max_depth": self._max_depth, "dropped": self._dropped, "errors": self._errors}
+
+  def close(self, wait = True):
+    '''!
+      @brief Stop the workers
+      @param wait  Run the queued callbacks first, default to be True
+    '''
+    with self._lock:
+      self._closed = True
+      if not wait:
+        for queue in self._queues:
+          self._depth -= len(queue)
+          queue.clear()
+      for cond in self._not_empty + self._not_full:
+        cond.notify_all()
+    for thread in self._threads:
+      if thread is not threading.current_thread():
+        thread.join()
+
+  def _run(self, i):
+    queue = self._queues[i]
+    while True:
+      with self._lock:
+        while not queue and not self._closed:
+          self._not_empty[i].wait()
+        if not queue:
+          return
+        callback, pin = queue.popleft()
+        self._depth -= 1
+        self._not_full[i].notify()
+      try:
+        callback(pin)
+      except Exception:
+        self._errors += 1
+        traceback.print_exc()
+
+
+class CH423EdgeSource(object):
+  '''!
+    @brief Source of falling edges of the GPO15/INT line used by CH423InterruptDispatcher. This base class is fed by notify(),
+    @n so any edge detection can be connected, for example:
+    @n   GPIO.add_event_detect(27, GPIO.FALLING, lambda channel: source.notify())
+  '''
+  def __init__(self):
+    self._event = threading.Event()
+    self._stamp = None
+
+  def notify(self, timestamp = None):
+    '''!
+      @brief Report a falling edge
+      @param timestamp  Monotonic time of the edge in seconds, default to be now
+    '''
+    self._stamp = monotonic() if timestamp is None else timestamp
+    self._event.set()
+
+  def wait_edge(self, timeout = None):
+    '''!
+      @brief Block until a falling edge arrives
+      @param timeout  Longest time to wait in seconds, default to be None (wait forever)
+      @return Monotonic time of the edge, or None on timeout
+    '''
+    if not self._event.wait(timeout):
+      return None
+    self._event.clear()
+    return self._stamp
+
+  def close(self):
+    '''!
+      @brief Release the line
+    '''
+    pass
+
+
+class CH423SimulatedEdgeSource(CH423EdgeSource):
+  '''!
+    @brief Edge source following the GPO15/INT output of a CH423Simulator
+  '''
+  def __init__(self, sim):
+    CH423EdgeSource.__init__(self)
+    self._sim = sim
+    sim.add_int_listener(self._on_level)
+
+  def _on_level(self, level):
+    if level == 0:
+      self.notify()
+
+  def close(self):
+    self._sim.remove_int_listener(self._on_level)
+
+
+class CH423GPIOChipEdgeSource(CH423EdgeSource):
+  '''!
+    @brief Edge source on a line of the Linux GPIO character device (/dev/gpiochipN), no extra module needed.
+    @n The kernel timestamps every edge, the thread sleeps in select() until one arrives. Kernels before 5.7 use
+    @n CLOCK_REALTIME for these timestamps; then the time the event is read is used instead, so latencies are not measured.
+  '''
+  ## ioctl request of a line event, linux/gpio.h: _IOWR(0xB4, 0x04, struct gpioevent_request)
+  GPIO_GET_LINEEVENT_IOCTL     = 0xC030B404
+  GPIOHANDLE_REQUEST_INPUT     = 1 << 0
+  GPIOEVENT_REQUEST_FALLING_EDGE = 1 << 1
+  _EVENT_REQUEST = struct.Struct("III32si")
+  _EVENT_DATA    = struct.Struct("QI4x")
+
+  def __init__(self, line = 27, chip = "/dev/gpiochip0"):
+    '''!
+      @param line  Line offset connected to GPO15/INT, on a Raspberry Pi the BCM number, default to be 27
+      @param chip  GPIO character device, default to be /dev/gpiochip0
+    '''
+    CH423EdgeSource.__init__(self)
+    fd = os.open(chip, os.O_RDONLY)
+    try:
+      req = bytearray(self._EVENT_REQUEST.pack(line, self.GPIOHANDLE_REQUEST_INPUT, self.GPIOEVENT_REQUEST_FALLING_EDGE, b"DFRobot_CH423", 0))
+      fcntl.ioctl(fd, self.GPIO_GET_LINEEVENT_IOCTL, req, True)
+    finally:
+      os.close(fd)
+    self._fd = self._EVENT_REQUEST.unpack(bytes(req))[4]
+    self._wake_r, self._wake_w = os.pipe()
+
+  def notify(self, timestamp = None):
+    self._stamp = monotonic() if timestamp is None else timestamp
+    os.write(self._wake_w, b"x")
+
+  def wait_edge(self, timeout = None):
+    if self._fd is None:
+      return None
+    readable = select.select([self._fd, self._wake_r], [], [], timeout)[0]
+    if self._wake_r in readable:
+      os.read(self._wake_r, 64)
+      return self._stamp
+    if self._fd not in readable:
+      return None
+    data = os.read(self._fd, self._EVENT_DATA.size * 16)
+    stamp = self._EVENT_DATA.unpack_from(data, len(data) - self._EVENT_DATA.size)[0] / 1e9
+    now   = monotonic()
+    if abs(stamp - now) > abs(stamp - time.time()):
+      # kernels before 5.7 stamp line events with CLOCK_REALTIME, which cannot be compared with monotonic times
+      return now
+    return stamp
+
+  def close(self):
+    if self._fd is not None:
+      os.close(self._fd)
+      os.close(self._wake_r)
+      os.close(self._wake_w)
+      self._fd = None
+
+
+class CH423InterruptDispatcher(object):
+  '''!
+    @brief Thread that blocks on the falling edge of GPO15/INT, then calls poll_interrupts() so the attached callbacks run.
+    @n No CPU is used while no interrupt occurs.
+  '''
+  def __init__(self, dev, source):
+    '''!
+      @param dev     DFRobot_CH423 object with interrupts attached and enabled
+      @param source  CH423EdgeSource, such as CH423GPIOChipEdgeSource or CH423SimulatedEdgeSource
+    '''
+    self._dev    = dev
+    self._source = source
+    self._thread = None
+    self._stop   = threading.Event()
+    self.reset_stats()
+
+  def start(self):
+    '''!
+      @brief Start the dispatcher thread
+    '''
+    if self.is_running():
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target = self._run, name = "CH423InterruptDispatcher")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self, close_source = True):
+    '''!
+      @brief Stop the dispatcher thread
+      @param close_source  Also release the edge source, default to be True
+    '''
+    self._stop.set()
+    self._source.notify()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self._thread = None
+    if close_source:
+      self._source.close()
+
+  def is_running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def get_stats(self):
+    '''!
+      @brief Get dispatcher statistics
+      @return dict with edges (edges handled), max_latency and avg_latency (edge to poll_interrupts() in seconds)
+    '''
+    edges = self._edges
+    return {"edges": edges, "max_latency": self._max_latency, "avg_latency": self._sum_latency / edges if edges else 0.0}
+
+  def reset_stats(self):
+    self._edges       = 0
+    self._max_latency = 0.0
+    self._sum_latency = 0.0
+
+  def _run(self):
+    while not self._stop.is_set():
+      stamp = self._source.wait_edge(1.0)
+      if stamp is None or self._stop.is_set():
+        continue
+      latency = monotonic() - stamp
+      self._edges += 1
+      self._sum_latency += latency
+      if latency > self._max_latency:
+        self._max_latency = latency
+      self._dev.poll_interrupts(stamp)
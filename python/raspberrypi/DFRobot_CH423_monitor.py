@@ -0,0 +1,127 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_monitor.py
+  @brief Bus transaction and method call statistics of DFRobot_CH423
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+from DFRobot_CH423_transport import CH423Transport, get_bus_lock
+from DFRobot_CH423_compat import monotonic, monotonic_ns
+
+
+class CH423BusMonitor(CH423Transport):
+  '''!
+    @brief Transport wrapper counting the transactions of another transport: per command reads, writes, data bytes,
+    @n errors and a latency histogram, plus call counts of driver methods. Installed by DFRobot_CH423.enable_stats().
+  '''
+  ## Upper bounds of the latency histogram buckets in microseconds, the last bucket holds everything slower
+  HIST_BOUNDS_US = tuple(1 << i for i in range(16))
+
+  def __init__(self, transport):
+    '''!
+      @param transport  Transport to monitor, the monitor shares its bus_lock
+    '''
+    self.transport = transport
+    self.bus_lock  = get_bus_lock(transport)
+    self._methods  = {}
+    self.reset_stats()
+
+  def write_byte(self, cmd, value):
+    start = monotonic_ns()
+    try:
+      self.transport.write_byte(cmd, value)
+    except Exception:
+      self._record(cmd, 1, 0, monotonic_ns() - start, 1)
+      raise
+    self._record(cmd, 1, 0, monotonic_ns() - start, 0)
+
+  def read_byte(self, cmd):
+    start = monotonic_ns()
+    try:
+      value = self.transport.read_byte(cmd)
+    except Exception:
+      self._record(cmd, 0, 1, monotonic_ns() - start, 1)
+      raise
+    self._record(cmd, 0, 1, monotonic_ns() - start, 0)
+    return value
+
+  def write_bytes(self, writes):
+    writes = list(writes)
+    if not writes:
+      return
+    start  = monotonic_ns()
+    error  = 0
+    try:
+      self.transport.write_bytes(writes)
+    except Exception:
+      error = 1
+      raise
+    finally:
+      # one bus transaction, its time is shared by the commands it carried
+      share = (monotonic_ns() - start) // len(writes)
+      self._transactions -= len(writes) - 1
+      for cmd, value in writes:
+        self._record(cmd, 1, 0, share, error)
+
+  def close(self):
+    self.transport.close()
+
+  def count_calls(self, name, method):
+    '''!
+      @brief Wrap a bound method so that its calls are counted under name
+      @return Wrapped method
+    '''
+    calls = self._methods
+    calls.setdefault(name, [0])
+    counter = calls[name]
+    def wrapper(*args, **kwargs):
+      counter[0] += 1
+      return method(*args, **kwargs)
+    return wrapper
+
+  def get_stats(self):
+    '''!
+      @brief Get a snapshot of the statistics
+      @return dict with elapsed (seconds since the last reset), transactions (bus transactions, a combined write_bytes counts once),
+      @n errors, methods ({name: calls}) and commands ({cmd: dict}); each command dict holds writes, reads, bytes (data bytes),
+      @n errors, avg_us and max_us (latency) and hist (transactions per HIST_BOUNDS_US bucket, the last entry counts slower ones)
+    '''
+    with self.bus_lock:
+      commands = {}
+      errors   = 0
+      for cmd, c in self._commands.items():
+        ops = c[0] + c[1]
+        errors += c[2]
+        commands[cmd] = {"writes": c[0], "reads": c[1], "bytes": ops, "errors": c[2],
+                         "avg_us": c[3] / 1000.0 / ops if ops else 0.0, "max_us": c[4] / 1000.0, "hist": list(c[5])}
+      return {"elapsed": monotonic() - self._started, "transactions": self._transactions, "errors": errors,
+              "methods": dict((name, n[0]) for name, n in self._methods.items() if n[0]), "commands": commands}
+
+  def reset_stats(self):
+    '''!
+      @brief Clear the statistics
+    '''
+    with self.bus_lock:
+      self._commands     = {}
+      self._transactions = 0
+      self._started      = monotonic()
+      for counter in self._methods.values():
+        counter[0] = 0
+
+  def _record(self, cmd, writes, reads, ns, error):
+    c = self._commands.get(cmd)
+    if c is None:
+      c = self._commands[cmd] = [0, 0, 0, 0, 0, [0]*(len(self.HIST_BOUNDS_US) + 1)]
+    c[0] += writes
+    c[1] += reads
+    c[2] += error
+    c[3] += ns
+    if ns > c[4]:
+      c[4] = ns
+    c[5][min((ns // 1000).bit_length(), len(self.HIST_BOUNDS_US))] += 1
+    self._transactions += 1
@@ -0,0 +1,339 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_output.py
+  @brief Timed output of DFRobot_CH423: pattern sequencer and software PWM on GPO0~GPO15
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import threading
+
+from DFRobot_CH423 import DFRobot_CH423
+from DFRobot_CH423_compat import monotonic
+
+
+class CH423Sequencer(object):
+  '''!
+    @brief Play timed output frames on a dedicated thread. Each step is a (duration, frame) pair, frame uses the 24-bit
+    @n layout of write_masked (bit0~bit7 for GPIO0~GPIO7, bit8~bit23 for GPO0~GPO15) and is held for duration seconds.
+    @n Steps are scheduled against a monotonic deadline clock, so late frames do not shift the following ones, and only
+    @n the registers that differ from the previous frame are written.
+  '''
+  ## Wake up this long before a deadline and busy-wait the rest, in seconds
+  SPIN_TIME = 0.001
+
+  def __init__(self, dev, mask = DFRobot_CH423.MASK_ALL):
+    '''!
+      @param dev   DFRobot_CH423 object
+      @param mask  24-bit mask of the pins the sequencer drives, default to be all 24 output lines
+    '''
+    self._dev     = dev
+    self._mask    = mask
+    self._thread  = None
+    self._stop    = threading.Event()
+    self._lock    = threading.Lock()
+    self._next    = None
+    self.reset_stats()
+
+  def play(self, steps, loop = False):
+    '''!
+      @brief Start playing a pattern, the pattern already playing is stopped first
+      @param steps  List or iterator of (duration, frame) pairs
+      @param loop   True to repeat the pattern until stop() is called
+    '''
+    self.stop()
+    self._stop.clear()
+    self._next   = None
+    self._thread = threading.Thread(target = self._run, args = (self._pattern(steps, loop),))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def swap(self, steps, loop = False):
+    '''!
+      @brief Replace the pattern being played, the new pattern starts at the next frame boundary
+      @param steps  List or iterator of (duration, frame) pairs
+      @param loop   True to repeat the new pattern until stop() is called
+    '''
+    if not self.is_running():
+      self.play(steps, loop)
+      return
+    with self._lock:
+      self._next = self._pattern(steps, loop)
+
+  def stop(self):
+    '''!
+      @brief Stop playing, the outputs keep the last frame
+    '''
+    self._stop.set()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self._thread = None
+
+  def wait(self, timeout = None):
+    '''!
+      @brief Wait for a pattern without loop to finish
+      @param timeout  Longest time to wait in seconds, default to be None (wait forever)
+      @return True if the pattern has finished
+    '''
+    thread = self._thread
+    if thread is not None:
+      thread.join(timeout)
+    return not self.is_running()
+
+  def is_running(self):
+    '''!
+      @brief Check whether a pattern is playing
+    '''
+    return self._thread is not None and self._thread.is_alive()
+
+  def get_stats(self):
+    '''!
+      @brief Get timing statistics
+      @return dict with frames (frames written), overruns (frames written after the next deadline had already passed),
+      @n max_jitter and avg_jitter (lateness of the frame writes in seconds)
+    '''
+    frames = self._frames
+    return {
+      "frames":     frames,
+      "overruns":   self._overruns,
+      "max_jitter": self._max_jitter,
+      "avg_jitter": self._sum_jitter / frames if frames else 0.0,
+    }
+
+  def reset_stats(self):
+    '''!
+      @brief Clear the timing statistics
+    '''
+    self._frames     = 0
+    self._overruns   = 0
+    self._max_jitter = 0.0
+    self._sum_jitter = 0.0
+
+  def _pattern(self, steps, loop):
+    if not loop:
+      return iter(steps)
+    steps = list(steps)
+    if not steps:
+      return iter(steps)
+    return self._repeat(steps)
+
+  def _repeat(self, steps):
+    while True:
+      for step in steps:
+        yield step
+
+  def _run(self, pattern):
+    dev      = self._dev
+    mask     = self._mask
+    stop     = self._stop
+    deadline = monotonic()
+    while not stop.is_set():
+      if self._next is not None:
+        with self._lock:
+          pattern, self._next = self._next, None
+      try:
+        duration, frame = next(pattern)
+      except StopIteration:
+        break
+      now = monotonic()
+      dev.write_masked(mask, frame)
+      jitter = now - deadline
+      self._frames += 1
+      self._sum_jitter += jitter
+      if jitter > self._max_jitter:
+        self._max_jitter = jitter
+      deadline += duration
+      remain = deadline - monotonic()
+      if remain < 0:
+        self._overruns += 1
+        continue
+      if remain > self.SPIN_TIME and stop.wait(remain - self.SPIN_TIME):
+        break
+      while monotonic() < deadline:
+        pass
+
+
+class CH423PWM(object):
+  '''!
+    @brief Software PWM on GPO0~GPO15. All driven pins switch on at the start of each period and each one switches off
+    @n after its duty time (sorted-edge scheduling). The switching times are precomputed into a table of 16-bit frames,
+    @n rebuilt only when a duty changes, and a dedicated thread writes the frames, so each slot only writes the GPO byte that changes.
+  '''
+  def __init__(self, dev, frequency = 100, resolution = 256):
+    '''!
+      @param dev         DFRobot_CH423 object
+      @param frequency   PWM base frequency in Hz, default to be 100
+      @param resolution  Number of duty steps per period, duties are rounded to it, default to be 256
+    '''
+    self._dev        = dev
+    self._period     = 1.0 / frequency
+    self._resolution = resolution
+    self._duty       = [0.0]*16
+    self._pins       = 0
+    self._table      = [(0.0, 0)]
+    self._dirty      = False
+    self._thread     = None
+    self._stop       = threading.Event()
+    self._write_time = 0.0
+    self._periods    = 0
+    self._overruns   = 0
+
+  def set_frequency(self, frequency):
+    '''!
+      @brief Set the PWM base frequency, takes effect at the next period
+      @param frequency  Frequency in Hz
+    '''
+    self._period = 1.0 / frequency
+    self._dirty  = True
+
+  def set_duty(self, gpo, duty):
+    '''!
+      @brief Set the duty cycle of a GPO pin, the pin is driven by the PWM engine from now on
+      @param gpo   GPO pin, eGPO0~eGPO15
+      @param duty  Duty cycle, 0.0~1.0
+    '''
+    if gpo < DFRobot_CH423.eGPO0 or gpo > DFRobot_CH423.eGPO15:
+      print("gpo argument range error.")
+      return None
+    duty = min(max(duty, 0.0), 1.0)
+    if self._pins & (1 << gpo) and self._duty[gpo] == duty:
+      return None
+    self._duty[gpo] = duty
+    self._pins |= 1 << gpo
+    self._dirty = True
+
+  def set_duties(self, duties):
+    '''!
+      @brief Set the duty cycles of several GPO pins at once
+      @param duties  dict of gpo: duty, or a list of 16 duties for GPO0~GPO15
+    '''
+    if not isinstance(duties, dict):
+      duties = dict(enumerate(duties))
+    for gpo in duties:
+      self.set_duty(gpo, duties[gpo])
+
+  def get_duty(self, gpo):
+    '''!
+      @brief Get the duty cycle of a GPO pin
+    '''
+    return self._duty[gpo]
+
+  def release(self, gpo):
+    '''!
+      @brief Stop driving a GPO pin, it keeps its last level
+      @param gpo  GPO pin, eGPO0~eGPO15
+    '''
+    self._pins &= ~(1 << gpo)
+    self._duty[gpo] = 0.0
+    self._dirty = True
+
+  def start(self):
+    '''!
+      @brief Start the PWM thread
+    '''
+    if self.is_running():
+      return
+    if not self._write_time:
+      self.calibrate()
+    self._stop.clear()
+    self._dirty  = True
+    self._thread = threading.Thread(target = self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    '''!
+      @brief Stop the PWM thread, the pins keep their current level
+    '''
+    self._stop.set()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self._thread = None
+
+  def is_running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def calibrate(self, count = 16):
+    '''!
+      @brief Measure how long one GPO register write takes by rewriting the current GPO_L value
+      @param count  Number of writes to average
+      @return Time of one write in seconds
+    '''
+    dev   = self._dev
+    level = dev.get_outputs() & dev.MASK_GPO0_7
+    start = monotonic()
+    for i in range(count):
+      dev.write_masked(dev.MASK_GPO0_7, level, force = True)
+    self._write_time = (monotonic() - start) / count
+    return self._write_time
+
+  def get_max_frequency(self):
+    '''!
+      @brief Get the highest base frequency the current duty table can hold on this bus
+      @return Frequency in Hz, each period needs one write per distinct switching time
+    '''
+    if not self._write_time:
+      self.calibrate()
+    if self._dirty:
+      self._build()
+    return 1.0 / (max(len(self._table), 2) * self._write_time)
+
+  def get_stats(self):
+    '''!
+      @brief Get PWM statistics
+      @return dict with periods (periods played), overruns (slots written late), slots (writes per period) and write_time (seconds per write)
+    '''
+    return {"periods": self._periods, "overruns": self._overruns, "slots": len(self._table), "write_time": self._write_time}
+
+  def _build(self):
+    self._dirty = False
+    period = self._period
+    steps  = self._resolution
+    on     = 0
+    edges  = {}
+    for gpo in range(16):
+      if not self._pins & (1 << gpo):
+        continue
+      n = int(round(self._duty[gpo] * steps))
+      if n <= 0:
+        continue
+      on |= 1 << gpo
+      if n < steps:
+        edges[n] = edges.get(n, 0) | (1 << gpo)
+    table = [(0.0, on)]
+    frame = on
+    for n in sorted(edges):
+      frame &= ~edges[n]
+      table.append((period * n / steps, frame))
+    self._table = table
+
+  def _run(self):
+    dev   = self._dev
+    stop  = self._stop
+    start = monotonic()
+    while not stop.is_set():
+      if self._dirty:
+        self._build()
+      table = self._table
+      mask  = self._pins << 8
+      for offset, frame in table:
+        deadline = start + offset
+        remain = deadline - monotonic()
+        if remain > CH423Sequencer.SPIN_TIME:
+          if stop.wait(remain - CH423Sequencer.SPIN_TIME):
+            return
+        elif remain < 0:
+          self._overruns += 1
+        while monotonic() < deadline:
+          pass
+        t = monotonic()
+        dev.write_masked(mask, frame << 8)
+        self._write_time += (monotonic() - t - self._write_time) / 16
+      self._periods += 1
+      start += self._period
+      if start < monotonic() - self._period:
+        start = monotonic()
@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_power.py
+  @brief Idle sleep manager of DFRobot_CH423
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import threading
+
+from DFRobot_CH423_compat import monotonic
+
+
+class CH423PowerManager(object):
+  '''!
+    @brief Thread putting the chip to sleep after a period without driver activity. The chip wakes up by itself on the next
+    @n bus access or GPIO interrupt, so the driver calls need no extra transaction; the thread only notices the wake up
+    @n afterwards, from the bus transactions of the driver, and counts it. Calls whose writes are all skipped are no activity,
+    @n and they do not wake a sleeping chip either. The chip is not put to sleep while it scans a display (display_mode()).
+  '''
+  def __init__(self, dev, idle_time = 1.0, interval = None):
+    '''!
+      @param dev        DFRobot_CH423 object
+      @param idle_time  Seconds without driver activity before the chip is put to sleep, default to be 1.0
+      @param interval   Seconds between activity checks, default to be idle_time / 4 but at most 0.05;
+      @n                it is also the resolution of the wake time measurement
+    '''
+    self._dev       = dev
+    self.idle_time  = idle_time
+    self.interval   = interval if interval is not None else min(idle_time / 4.0, 0.05)
+    self._thread    = None
+    self._stop      = threading.Event()
+    self._asleep    = False
+    self.reset_stats()
+
+  def start(self):
+    '''!
+      @brief Start watching the driver activity
+    '''
+    if self.is_running():
+      return
+    self._stop.clear()
+    self._thread = threading.Thread(target = self._run, name = "CH423PowerManager")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    '''!
+      @brief Stop the thread, a sleeping chip stays asleep until the next access
+    '''
+    self._stop.set()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self._thread = None
+
+  def is_running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def is_asleep(self):
+    '''!
+      @brief True while the chip was put to sleep and no driver activity has been seen since
+    '''
+    return self._asleep
+
+  def get_stats(self):
+    '''!
+      @brief Get power statistics
+      @return dict with sleeps (times put to sleep), wakes (wake ups seen), time_asleep (seconds) and asleep
+    '''
+    asleep = self._time_asleep
+    if self._asleep:
+      asleep += monotonic() - self._slept_at
+    return {"sleeps": self._sleeps, "wakes": self._wakes, "time_asleep": asleep, "asleep": self._asleep}
+
+  def reset_stats(self):
+    self._sleeps      = 0
+    self._wakes       = 0
+    self._time_asleep = 0.0
+    self._slept_at    = monotonic()
+
+  def _run(self):
+    dev  = self._dev
+    seen = dev.get_activity()
+    idle_since = monotonic()
+    while not self._stop.wait(self.interval):
+      now = monotonic()
+      activity = dev.get_activity()
+      if activity != seen:
+        seen = activity
+        idle_since = now
+        if self._asleep:
+          self._asleep = False
+          self._wakes += 1
+          self._time_asleep += now - self._slept_at
+        continue
+      if self._asleep or now - idle_since < self.idle_time:
+        continue
+      try:
+        activity = dev.sleep_if_idle(seen)
+      except (IOError, OSError):
+        # try again after the next idle period
+        idle_since = now
+        continue
+      if activity is None:
+        # busy or scanning a display, check again after the next idle period
+        idle_since = now
+        continue
+      seen = activity
+      self._slept_at = monotonic()
+      self._asleep   = True
+      self._sleeps  += 1
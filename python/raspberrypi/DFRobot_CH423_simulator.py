@@ -0,0 +1,201 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_simulator.py
+  @brief In-memory model of the CH423, runs the driver without a Raspberry Pi
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import time
+
+from DFRobot_CH423 import DFRobot_CH423
+from DFRobot_CH423_transport import CH423Transport
+from DFRobot_CH423_compat import monotonic
+
+
+class CH423Simulator(CH423Transport):
+  '''!
+    @brief In-memory model of the CH423, used in place of a real bus for tests and benchmarks.
+    @n It models the system parameter byte, the GPO_L/GPO_H and GPIO latches, the display data of DIG0~DIG15,
+    @n the GPIO input levels, the input change interrupt on GPO15 and sleep mode (any bus access or input change wakes the chip up).
+  '''
+  def __init__(self, inputs = 0xFF, latency = 0):
+    '''!
+      @param inputs   Level driven onto GPIO0~GPIO7 from outside, default to be 0xFF (floating pins read high)
+      @param latency  Time in seconds each bus transaction takes, default to be 0
+    '''
+    self.inputs      = inputs & 0xFF
+    self.latency     = latency
+    self.writes      = 0
+    self.reads       = 0
+    self.counts      = {}
+    self._listeners  = []
+    self._failures   = 0
+    self._fail_reset = False
+    self.reset()
+
+  def reset(self):
+    '''!
+      @brief Return the chip to its power-on state, as after a reset or brown-out. Transaction counters are kept.
+    '''
+    self.args       = 0
+    self.gpo_l      = 0
+    self.gpo_h      = 0
+    self.gpio_latch = 0
+    self.digits     = [0]*16
+    self.sleep_count = 0
+    self.wake_count  = 0
+    self._int_level = 1
+
+  @property
+  def transactions(self):
+    '''!
+      @brief Total number of bus transactions handled
+    '''
+    return self.writes + self.reads
+
+  @property
+  def sleeping(self):
+    '''!
+      @brief True while the chip is in sleep mode
+    '''
+    return bool(self.args & (1 << DFRobot_CH423.ARGS_BIT_SLEEP))
+
+  def reset_counters(self):
+    '''!
+      @brief Clear the transaction counters
+    '''
+    self.writes = 0
+    self.reads  = 0
+    self.counts = {}
+
+  def write_byte(self, cmd, value):
+    self._transaction(cmd)
+    self.writes += 1
+    value &= 0xFF
+    if cmd == DFRobot_CH423.CH423_CMD_SET_SYSTEM_ARGS:
+      self.args = value
+      if self.sleeping:
+        self.sleep_count += 1
+    elif cmd == DFRobot_CH423.CH423_CMD_SET_GPO_L:
+      self.gpo_l = value
+    elif cmd == DFRobot_CH423.CH423_CMD_SET_GPO_H:
+      self.gpo_h = value
+    elif cmd == DFRobot_CH423.CH423_CMD_SET_GPIO:
+      self.gpio_latch = value
+      self.digits[0]  = value
+    elif DFRobot_CH423.CH423_CMD_SET_DIG0 < cmd < DFRobot_CH423.CH423_CMD_SET_DIG0 + 16:
+      self.digits[cmd - DFRobot_CH423.CH423_CMD_SET_DIG0] = value
+    else:
+      raise IOError(121, "Remote I/O error")
+    self._update_int()
+
+  def read_byte(self, cmd):
+    if cmd != DFRobot_CH423.CH423_CMD_READ_GPIO:
+      self._transaction(cmd)
+      raise IOError(121, "Remote I/O error")
+    self._transaction(cmd)
+    self.reads += 1
+    return self.gpio_levels()
+
+  def gpio_levels(self):
+    '''!
+      @brief Level of GPIO0~GPIO7, the output latch in output mode or the external inputs in input mode
+    '''
+    if self.args & (1 << DFRobot_CH423.ARGS_BIT_IO_EN):
+      return self.gpio_latch
+    return self.inputs
+
+  def gpo_levels(self):
+    '''!
+      @brief Level of GPO0~GPO15, bit15 follows the interrupt output while input change interrupt is enabled
+    '''
+    levels = (self.gpo_h << 8) | self.gpo_l
+    if self._int_enabled():
+      levels = (levels & 0x7FFF) | (self._int_level << 15)
+    return levels
+
+  def int_level(self):
+    '''!
+      @brief Level of the interrupt output GPO15/INT, 0 while an input differs from the level written to the GPIO latch
+    '''
+    return self._int_level
+
+  def set_inputs(self, levels, mask = 0xFF):
+    '''!
+      @brief Drive GPIO pins from outside
+      @param levels  Levels of GPIO0~GPIO7, bit0~bit7
+      @param mask    Pins to drive, the other pins keep their level
+    '''
+    inputs = (self.inputs & ~mask) | (levels & mask)
+    inputs &= 0xFF
+    if inputs == self.inputs:
+      return
+    self.inputs = inputs
+    if self.sleeping and not (self.args & (1 << DFRobot_CH423.ARGS_BIT_IO_EN)):
+      self._wake()
+    self._update_int()
+
+  def set_input(self, gpio, level):
+    '''!
+      @brief Drive one GPIO pin from outside
+      @param gpio   GPIO pin, 0~7
+      @param level  1 for high, 0 for low
+    '''
+    self.set_inputs(0xFF if level else 0x00, 1 << gpio)
+
+  def add_int_listener(self, callback):
+    '''!
+      @brief Register a function called as callback(level) whenever the GPO15/INT level changes
+    '''
+    self._listeners.append(callback)
+
+  def remove_int_listener(self, callback):
+    self._listeners.remove(callback)
+
+  def fail(self, count = 1, reset = False):
+    '''!
+      @brief Make the next transactions fail with IOError, to test error handling
+      @param count  Number of failing transactions, default to be 1
+      @param reset  Also return the chip to its power-on state at the first failure, like a brown-out, default to be False
+    '''
+    self._failures   = count
+    self._fail_reset = reset
+
+  def _transaction(self, cmd):
+    self.counts[cmd] = self.counts.get(cmd, 0) + 1
+    if self._failures:
+      self._failures -= 1
+      if self._fail_reset:
+        self._fail_reset = False
+        self.reset()
+      raise IOError(121, "Remote I/O error")
+    if self.latency:
+      deadline = monotonic() + self.latency
+      if self.latency > 0.002:
+        time.sleep(self.latency - 0.001)
+      while monotonic() < deadline:
+        pass
+    if self.sleeping:
+      self._wake()
+
+  def _wake(self):
+    self.args &= ~(1 << DFRobot_CH423.ARGS_BIT_SLEEP)
+    self.wake_count += 1
+
+  def _int_enabled(self):
+    return (self.args & (1 << DFRobot_CH423.ARGS_BIT_INT_EN)) and not (self.args & (1 << DFRobot_CH423.ARGS_BIT_DEC_H))
+
+  def _update_int(self):
+    level = 1
+    if self._int_enabled() and not (self.args & (1 << DFRobot_CH423.ARGS_BIT_IO_EN)):
+      if self.inputs != self.gpio_latch:
+        level = 0
+    if level != self._int_level:
+      self._int_level = level
+      for callback in list(self._listeners):
+        callback(level)
@@ -0,0 +1,207 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_trace.py
+  @brief Bus trace recorder and reader of DFRobot_CH423
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import time
+import struct
+
+from DFRobot_CH423_transport import CH423Transport, get_bus_lock
+from DFRobot_CH423_compat import monotonic, monotonic_ns
+
+
+class CH423TraceRecorder(CH423Transport):
+  '''!
+    @brief Transport wrapper writing every operation of another transport to a binary trace file, read it back with CH423TraceReader.
+    @n The file starts with MAGIC and the monotonic start time in ns (uint64), followed by 7-byte records:
+    @n uint32 microseconds since the previous record, command, flags (FLAG_READ, FLAG_ERROR, FLAG_TIME) and data byte,
+    @n little-endian. A FLAG_TIME record only carries time, it is inserted when a gap does not fit in 32 bits.
+  '''
+  MAGIC      = b"CH423TR1"
+  HEADER     = struct.Struct("<8sQ")
+  RECORD     = struct.Struct("<IBBB")
+  FLAG_READ  = 0x01
+  FLAG_ERROR = 0x02
+  FLAG_TIME  = 0x80
+
+  def __init__(self, transport, path, buffer_size = 4096):
+    '''!
+      @param transport    Transport to record, the recorder shares its bus_lock
+      @param path         Trace file, overwritten
+      @param buffer_size  Bytes collected before they are written to the file, default to be 4096
+    '''
+    self.transport    = transport
+    self.bus_lock     = get_bus_lock(transport)
+    self.records      = 0
+    self._size        = buffer_size
+    self._buf         = bytearray()
+    self._last        = monotonic_ns()
+    self._file        = open(path, "wb")
+    self._file.write(self.HEADER.pack(self.MAGIC, self._last))
+
+  def write_byte(self, cmd, value):
+    try:
+      self.transport.write_byte(cmd, value)
+    except Exception:
+      self._record(cmd, self.FLAG_ERROR, value)
+      raise
+    self._record(cmd, 0, value)
+
+  def write_bytes(self, writes):
+    writes = list(writes)
+    try:
+      self.transport.write_bytes(writes)
+    except Exception:
+      for cmd, value in writes:
+        self._record(cmd, self.FLAG_ERROR, value)
+      raise
+    for cmd, value in writes:
+      self._record(cmd, 0, value)
+
+  def read_byte(self, cmd):
+    try:
+      value = self.transport.read_byte(cmd)
+    except Exception:
+      self._record(cmd, self.FLAG_READ | self.FLAG_ERROR, 0)
+      raise
+    self._record(cmd, self.FLAG_READ, value)
+    return value
+
+  def flush(self):
+    '''!
+      @brief Write the buffered records to the file
+    '''
+    with self.bus_lock:
+      if self._file is not None:
+        self._file.write(bytes(self._buf))
+        self._file.flush()
+        del self._buf[:]
+
+  def stop(self):
+    '''!
+      @brief Flush and close the trace file, the wrapped transport stays open
+    '''
+    with self.bus_lock:
+      if self._file is not None:
+        self.flush()
+        self._file.close()
+        self._file = None
+
+  def close(self):
+    self.stop()
+    self.transport.close()
+
+  def _record(self, cmd, flags, value):
+    if self._file is None:
+      return
+    now   = monotonic_ns()
+    delta = (now - self._last) // 1000
+    self._last += delta * 1000
+    while delta > 0xFFFFFFFF:
+      self._buf += self.RECORD.pack(0xFFFFFFFF, 0, self.FLAG_TIME, 0)
+      delta -= 0xFFFFFFFF
+    self._buf += self.RECORD.pack(delta, cmd, flags, value & 0xFF)
+    self.records += 1
+    if len(self._buf) >= self._size:
+      self._file.write(bytes(self._buf))
+      del self._buf[:]
+
+
+class CH423TraceReader(object):
+  '''!
+    @brief Reader of a CH423TraceRecorder file. Iterating yields (timestamp, cmd, data, read, error) tuples,
+    @n timestamp is the monotonic time in seconds, read and error are booleans.
+  '''
+  def __init__(self, path):
+    '''!
+      @param path  Trace file
+    '''
+    with open(path, "rb") as f:
+      data = f.read()
+    header = CH423TraceRecorder.HEADER
+    if len(data) < header.size or data[:8] != CH423TraceRecorder.MAGIC:
+      raise ValueError("%s is not a CH423 trace"%path)
+    self.start = header.unpack_from(data)[1]
+    self._data = data
+
+  def __iter__(self):
+    record = CH423TraceRecorder.RECORD
+    data   = self._data
+    stamp  = self.start
+    end    = len(data) - (len(data) - CH423TraceRecorder.HEADER.size) % record.size
+    for offset in range(CH423TraceRecorder.HEADER.size, end, record.size):
+      delta, cmd, flags, value = record.unpack_from(data, offset)
+      stamp += delta * 1000
+      if flags & CH423TraceRecorder.FLAG_TIME:
+        continue
+      yield (stamp / 1e9, cmd, value, bool(flags & CH423TraceRecorder.FLAG_READ), bool(flags & CH423TraceRecorder.FLAG_ERROR))
+
+  def summary(self):
+    '''!
+      @brief Summarise the trace
+      @return dict with transactions, reads, writes, errors, duration (seconds from first to last operation), rate (transactions per second),
+      @n read_write_ratio, redundant_writes (writes repeating the last value written to the same command) and commands ({cmd: transactions})
+    '''
+    reads = writes = errors = redundant = 0
+    first = last = None
+    written  = {}
+    commands = {}
+    for stamp, cmd, value, read, error in self:
+      if first is None:
+        first = stamp
+      last = stamp
+      commands[cmd] = commands.get(cmd, 0) + 1
+      if error:
+        errors += 1
+      if read:
+        reads += 1
+      else:
+        writes += 1
+        if not error:
+          if written.get(cmd) == value:
+            redundant += 1
+          written[cmd] = value
+    total    = reads + writes
+    duration = last - first if total else 0.0
+    return {"transactions": total, "reads": reads, "writes": writes, "errors": errors, "duration": duration,
+            "rate": total / duration if duration > 0 else 0.0, "read_write_ratio": float(reads) / writes if writes else 0.0,
+            "redundant_writes": redundant, "commands": commands}
+
+  def replay(self, transport, speed = 1.0):
+    '''!
+      @brief Send the recorded operations to a transport, such as CH423Simulator. Failed operations are skipped. Before each read
+      @n the GPIO inputs of a simulator are set to the recorded value, so the replay follows the same path as the capture.
+      @param transport  Target transport
+      @param speed      1.0 keeps the recorded timing, 2.0 runs twice as fast, 0 runs at maximum speed
+      @return dict with operations (operations sent), mismatches (reads returning another value than recorded) and elapsed (seconds)
+    '''
+    set_inputs = getattr(transport, "set_inputs", None)
+    operations = mismatches = 0
+    started = monotonic()
+    first   = None
+    for stamp, cmd, value, read, error in self:
+      if error:
+        continue
+      if first is None:
+        first = stamp
+      if speed > 0:
+        delay = started + (stamp - first) / speed - monotonic()
+        if delay > 0:
+          time.sleep(delay)
+      if read:
+        # the GPIO levels are the only data the CH423 reads back
+        if set_inputs is not None:
+          set_inputs(value)
+        if transport.read_byte(cmd) != value:
+          mismatches += 1
+      else:
+        transport.write_byte(cmd, value)
+      operations += 1
+    return {"operations": operations, "mismatches": mismatches, "elapsed": monotonic() - started}
@@ -0,0 +1,255 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file DFRobot_CH423_transport.py
+  @brief Bus transports of DFRobot_CH423: the transport interface and the smbus transport with its process-wide handle pool
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import os
+import errno
+import ctypes
+import threading
+# smbus is imported by the first bus access, see SMBusPool
+smbus = None
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+def _import_smbus():
+  global smbus
+  if smbus is None:
+    import smbus as module
+    smbus = module
+  return smbus
+
+_bus_locks_guard = threading.Lock()
+
+def get_bus_lock(transport):
+  '''!
+    @brief Lock of a transport, created on first use and shared by every driver and wrapper on it
+    @param transport  Transport object
+    @return threading.RLock
+  '''
+  # SMBusTransport objects of the same bus number all carry the lock of their SMBusPool,
+  # so drivers created with DFRobot_CH423(bus = n) share one lock per bus
+  lock = getattr(transport, "bus_lock", None)
+  if lock is None:
+    with _bus_locks_guard:
+      lock = getattr(transport, "bus_lock", None)
+      if lock is None:
+        lock = threading.RLock()
+        transport.bus_lock = lock
+  return lock
+
+
+class CH423Transport(object):
+  '''!
+    @brief Bus transport used by DFRobot_CH423. The CH423 uses the I2C address itself as the command, so a transport
+    @n only has to send one data byte to a command address or read one byte back from it.
+    @n Drivers built on the same transport object share its bus_lock, calls from several threads never interleave on the bus.
+  '''
+  def write_byte(self, cmd, value):
+    '''!
+      @brief Send one data byte to a CH423 command
+      @param cmd    Command, such as DFRobot_CH423.CH423_CMD_SET_GPO_L
+      @param value  Data byte, 0x00~0xFF
+    '''
+    raise NotImplementedError
+
+  def read_byte(self, cmd):
+    '''!
+      @brief Read one data byte from a CH423 command
+      @param cmd  Command, such as DFRobot_CH423.CH423_CMD_READ_GPIO
+      @return Data byte
+    '''
+    raise NotImplementedError
+
+  def write_bytes(self, writes):
+    '''!
+      @brief Send several CH423 commands in order. Transports that can combine them into one bus operation override this.
+      @param writes  Sequence of (cmd, value) pairs
+    '''
+    for cmd, value in writes:
+      self.write_byte(cmd, value)
+
+  def close(self):
+    '''!
+      @brief Release the bus
+    '''
+    pass
+
+
+class _I2cMsg(ctypes.Structure):
+  _fields_ = [("addr", ctypes.c_uint16), ("flags", ctypes.c_uint16), ("len", ctypes.c_uint16), ("buf", ctypes.POINTER(ctypes.c_uint8))]
+
+
+class _I2cRdwrIoctlData(ctypes.Structure):
+  _fields_ = [("msgs", ctypes.POINTER(_I2cMsg)), ("nmsgs", ctypes.c_uint32)]
+
+
+class SMBusPool(object):
+  '''!
+    @brief Process-wide pool of /dev/i2c-N handles. The SMBusTransport objects of one bus share a single handle and a single
+    @n bus lock; the handle is opened by the first transaction and closed when the last transport using it is closed.
+  '''
+  def __init__(self):
+    self._guard   = threading.Lock()
+    self._locks   = {}
+    self._handles = {}
+
+  def lock(self, bus):
+    '''!
+      @brief Lock shared by every transport of a bus
+      @param bus  I2C bus number
+      @return threading.RLock
+    '''
+    with self._guard:
+      lock = self._locks.get(bus)
+      if lock is None:
+        lock = self._locks[bus] = threading.RLock()
+      return lock
+
+  def acquire(self, bus):
+    '''!
+      @brief Take a reference to the handle of a bus, the first reference imports smbus and opens /dev/i2c-N
+      @param bus  I2C bus number
+      @return smbus.SMBus object
+    '''
+    with self._guard:
+      entry = self._handles.get(bus)
+      if entry is None:
+        entry = self._handles[bus] = [_import_smbus().SMBus(bus), None, 0]
+      entry[2] += 1
+      return entry[0]
+
+  def fileno(self, bus):
+    '''!
+      @brief File descriptor of /dev/i2c-N for ioctl transfers, opened on first use and shared like the handle
+      @param bus  I2C bus number, must be acquired
+    '''
+    with self._guard:
+      entry = self._handles[bus]
+      if entry[1] is None:
+        entry[1] = os.open("/dev/i2c-%d"%bus, os.O_RDWR)
+      return entry[1]
+
+  def release(self, bus):
+    '''!
+      @brief Drop a reference taken by acquire(), the handle is closed with the last one
+      @param bus  I2C bus number
+    '''
+    with self._guard:
+      entry = self._handles.get(bus)
+      if entry is None:
+        return
+      entry[2] -= 1
+      if entry[2] > 0:
+        return
+      del self._handles[bus]
+    if entry[1] is not None:
+      os.close(entry[1])
+    entry[0].close()
+
+  def get_open_buses(self):
+    '''!
+      @brief Buses with an open handle
+      @return dict {bus number: number of transports using it}
+    '''
+    with self._guard:
+      return dict((bus, entry[2]) for bus, entry in self._handles.items())
+
+_smbus_pool = SMBusPool()
+
+
+class SMBusTransport(CH423Transport):
+  '''!
+    @brief Transport on a Linux I2C adapter through the smbus module. The bus is opened by the first transaction, from a
+    @n process-wide SMBusPool, so transports of the same bus share one handle and one bus lock.
+  '''
+  def __init__(self, bus = 1, pool = None):
+    '''!
+      @param bus   I2C bus number, 1 for /dev/i2c-1
+      @param pool  SMBusPool, default to be the pool shared by the whole process
+    '''
+    self.bus_num  = bus
+    self.pool     = pool if pool is not None else _smbus_pool
+    self.bus_lock = self.pool.lock(bus)
+    self._smbus   = None
+    self._fd      = None
+    self._rdwr    = fcntl is not None
+
+  ## ioctl request of the combined read/write transfer, linux/i2c-dev.h
+  I2C_RDWR           = 0x0707
+  ## Most messages the kernel accepts in one I2C_RDWR transfer
+  I2C_RDWR_MAX_MSGS  = 42
+  _NO_RDWR_ERRNOS    = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.ENOENT, errno.EACCES)
+
+  def write_byte(self, cmd, value):
+    bus = self._smbus
+    if bus is None:
+      bus = self._open()
+    bus.write_byte(cmd, value)
+
+  def write_bytes(self, writes):
+    '''!
+      @brief Send several CH423 commands in one I2C_RDWR ioctl on /dev/i2c-N, one message per command.
+      @n Falls back to one write_byte per command when the adapter or platform does not support I2C_RDWR.
+      @param writes  Sequence of (cmd, value) pairs
+    '''
+    writes = list(writes)
+    if self._smbus is None:
+      self._open()
+    if self._rdwr:
+      try:
+        i = 0
+        while i < len(writes):
+          self._ioctl_write(writes[i:i + self.I2C_RDWR_MAX_MSGS])
+          i += self.I2C_RDWR_MAX_MSGS
+        return
+      except (IOError, OSError) as e:
+        if i or e.errno not in self._NO_RDWR_ERRNOS:
+          raise
+        self._rdwr = False
+    CH423Transport.write_bytes(self, writes)
+
+  def read_byte(self, cmd):
+    bus = self._smbus
+    if bus is None:
+      bus = self._open()
+    return bus.read_byte(cmd)
+
+  def close(self):
+    '''!
+      @brief Release the handle of the bus, the next transaction takes it again
+    '''
+    with self.bus_lock:
+      if self._smbus is not None:
+        self._smbus = None
+        self._fd    = None
+        self.pool.release(self.bus_num)
+
+  def _open(self):
+    with self.bus_lock:
+      if self._smbus is None:
+        self._smbus = self.pool.acquire(self.bus_num)
+      return self._smbus
+
+  def _ioctl_write(self, writes):
+    if self._fd is None:
+      self._fd = self.pool.fileno(self.bus_num)
+    n    = len(writes)
+    data = (ctypes.c_uint8 * n)(*[value & 0xFF for cmd, value in writes])
+    msgs = (_I2cMsg * n)()
+    for i in range(n):
+      msgs[i].addr  = writes[i][0]
+      msgs[i].flags = 0
+      msgs[i].len   = 1
+      msgs[i].buf   = ctypes.cast(ctypes.byref(data, i), ctypes.POINTER(ctypes.c_uint8))
+    rdwr = _I2cRdwrIoctlData(msgs, n)
+    fcntl.ioctl(self._fd, self.I2C_RDWR, rdwr)
@@ -0,0 +1,209 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file bench_ch423.py
+  @brief Benchmark of the DFRobot_CH423 hot paths. Measures calls per second and bus transactions per call of the pin
+  @n  writes, reads and poll_interrupts(), and the time from a GPIO edge to the interrupt callback.
+  @n  Runs against CH423Simulator by default, --bus N uses /dev/i2c-N (the cases that need driven inputs are skipped there).
+  @n  The results are printed as JSON; --baseline compares them with an earlier result and exits with status 1 on a regression.
+  @n    python bench_ch423.py --output base.json
+  @n    python bench_ch423.py --baseline base.json
+
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import sys
+import os
+import json
+import time
+import platform
+import threading
+import argparse
+
+clock = getattr(time, "perf_counter", time.time)
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from DFRobot_CH423 import *
+from DFRobot_CH423_simulator import CH423Simulator
+from DFRobot_CH423_interrupt import CH423InterruptDispatcher, CH423SimulatedEdgeSource
+
+def make_device(args):
+  if args.bus is None:
+    sim = CH423Simulator(latency = args.latency)
+    return DFRobot_CH423(transport = sim), sim
+  return DFRobot_CH423(bus = args.bus), None
+
+def run_case(dev, setup, step, calls, duration):
+  '''!
+    @brief Time step(i) and count its bus transactions
+    @return dict with calls_per_sec, us_per_call and transactions_per_call
+  '''
+  setup()
+  # transactions are counted in a separate pass, so the timed loop runs without the monitor
+  monitor = dev.enable_stats()
+  for i in range(calls):
+    step(i)
+  transactions = monitor.get_stats()["transactions"]
+  dev.disable_stats()
+  setup()
+  n = 0
+  start = clock()
+  deadline = start + duration
+  while True:
+    for i in range(calls):
+      step(i)
+    n += calls
+    now = clock()
+    if now >= deadline:
+      break
+  elapsed = now - start
+  return {"calls": n, "calls_per_sec": n / elapsed, "us_per_call": elapsed / n * 1e6,
+          "transactions_per_call": float(transactions) / calls}
+
+def write_cases(dev, sim):
+  cases = {}
+  def outputs():
+    dev.begin(dev.eOUTPUT)
+  cases["gpio_digital_write"] = (outputs, lambda i: dev.gpio_digital_write(dev.eGPIO0, i & 1))
+  cases["gpio_digital_write_unchanged"] = (outputs, lambda i: dev.gpio_digital_write(dev.eGPIO0, 1))
+  cases["gpo_digital_write"] = (outputs, lambda i: dev.gpo_digital_write(dev.eGPO0, i & 1))
+  cases["gpo_digital_write_total"] = (outputs, lambda i: dev.gpo_digital_write(dev.eGPO_TOTAL, i & 0xFF))
+  cases["group_digital_write"] = (outputs, lambda i: dev.group_digital_write(dev.eGPO0_7, i & 0xFF))
+  def inputs():
+    dev.begin(dev.eINPUT)
+  cases["gpio_digital_read"] = (inputs, lambda i: dev.gpio_digital_read(dev.eGPIO0))
+  cases["gpio_digital_read_total"] = (inputs, lambda i: dev.gpio_digital_read(dev.eGPIO_TOTAL))
+  return cases
+
+def poll_cases(dev, sim):
+  cases = {}
+  def attach(pins, mode, pool = False):
+    def setup():
+      dev.disable_callback_pool()
+      dev.begin(dev.eINPUT)
+      for pin in range(pins):
+        dev.gpio_attach_interrupt(pin, mode, lambda pin: None)
+      dev.enable_interrupt()
+      if pool:
+        dev.enable_callback_pool()
+      if sim is not None:
+        sim.set_inputs(0xFF)
+    return setup
+  cases["poll_interrupts_idle"] = (attach(8, dev.eCHANGE), lambda i: dev.poll_interrupts())
+  if sim is None:
+    return cases
+  def toggle(mask):
+    def step(i):
+      sim.set_inputs(0x00 if i & 1 == 0 else 0xFF, mask)
+      dev.poll_interrupts()
+    return step
+  cases["poll_interrupts_1_callback"] = (attach(1, dev.eCHANGE), toggle(0x01))
+  cases["poll_interrupts_8_callbacks"] = (attach(8, dev.eCHANGE), toggle(0xFF))
+  cases["poll_interrupts_8_callbacks_pool"] = (attach(8, dev.eCHANGE, pool = True), toggle(0xFF))
+  cases["poll_interrupts_falling_only"] = (attach(8, dev.eFALLING), toggle(0xFF))
+  return cases
+
+def interrupt_latency(dev, sim, samples):
+  '''!
+    @brief Time from driving GPIO0 on the simulator to the callback run by CH423InterruptDispatcher
+    @return dict with samples, avg_us, p50_us, p99_us and max_us
+  '''
+  dev.disable_callback_pool()
+  dev.begin(dev.eINPUT)
+  sim.set_inputs(0xFF)
+  fired = threading.Event()
+  stamps = []
+  def callback(pin):
+    stamps.append(clock())
+    fired.set()
+  dev.gpio_attach_interrupt(dev.eGPIO0, dev.eCHANGE, callback)
+  dev.enable_interrupt()
+  dispatcher = CH423InterruptDispatcher(dev, CH423SimulatedEdgeSource(sim))
+  dispatcher.start()
+  latencies = []
+  try:
+    for i in range(samples):
+      fired.clear()
+      start = clock()
+      sim.set_input(0, i & 1)
+      if not fired.wait(1.0):
+        continue
+      latencies.append((stamps[-1] - start) * 1e6)
+  finally:
+    dispatcher.stop()
+  latencies.sort()
+  n = len(latencies)
+  if not n:
+    return {"samples": 0}
+  return {"samples": n, "avg_us": sum(latencies) / n, "p50_us": latencies[n // 2],
+          "p99_us": latencies[min(n - 1, int(n * 0.99))], "max_us": latencies[-1]}
+
+def compare(results, baseline, threshold):
+  '''!
+    @brief Compare with a baseline result
+    @return List of regression descriptions
+  '''
+  regressions = []
+  base_cases = baseline.get("cases", {})
+  for name, case in sorted(results["cases"].items()):
+    base = base_cases.get(name)
+    if base is None:
+      continue
+    if case["calls_per_sec"] < base["calls_per_sec"] * (1.0 - threshold):
+      regressions.append("%s: %.0f calls/s, baseline %.0f"%(name, case["calls_per_sec"], base["calls_per_sec"]))
+    if case["transactions_per_call"] > base["transactions_per_call"] + 1e-9:
+      regressions.append("%s: %.3f transactions/call, baseline %.3f"%(name, case["transactions_per_call"], base["transactions_per_call"]))
+  base_lat = baseline.get("interrupt_latency", {})
+  lat = results.get("interrupt_latency", {})
+  if "p50_us" in base_lat and "p50_us" in lat and lat["p50_us"] > base_lat["p50_us"] * (1.0 + threshold):
+    regressions.append("interrupt_latency: p50 %.1f us, baseline %.1f us"%(lat["p50_us"], base_lat["p50_us"]))
+  return regressions
+
+def main():
+  parser = argparse.ArgumentParser(description = "DFRobot_CH423 benchmark")
+  parser.add_argument("--bus", type = int, default = None, help = "I2C bus number, default to be the simulator")
+  parser.add_argument("--latency", type = float, default = 0.0, help = "simulated bus transaction time in seconds")
+  parser.add_argument("--duration", type = float, default = 0.5, help = "seconds per case")
+  parser.add_argument("--calls", type = int, default = 200, help = "calls per timing round and transaction count")
+  parser.add_argument("--latency-samples", type = int, default = 200, help = "edges for the interrupt latency")
+  parser.add_argument("--only", default = None, help = "run only the cases containing this text")
+  parser.add_argument("--output", default = None, help = "write the JSON result to this file")
+  parser.add_argument("--baseline", default = None, help = "JSON result to compare with")
+  parser.add_argument("--threshold", type = float, default = 0.2, help = "allowed slowdown against the baseline, default 0.2 (20%%)")
+  args = parser.parse_args()
+
+  dev, sim = make_device(args)
+  cases = write_cases(dev, sim)
+  cases.update(poll_cases(dev, sim))
+  results = {"transport": "simulator" if sim is not None else "/dev/i2c-%d"%args.bus,
+             "python": platform.python_version(), "machine": platform.machine(), "cases": {}}
+  for name in sorted(cases):
+    if args.only and args.only not in name:
+      continue
+    setup, step = cases[name]
+    results["cases"][name] = run_case(dev, setup, step, args.calls, args.duration)
+  dev.disable_callback_pool()
+  if sim is not None and (not args.only or args.only in "interrupt_latency"):
+    results["interrupt_latency"] = interrupt_latency(dev, sim, args.latency_samples)
+
+  text = json.dumps(results, indent = 2, sort_keys = True)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(text + "\n")
+  print(text)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+      print("REGRESSION " + line, file = sys.stderr)
+    if regressions:
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
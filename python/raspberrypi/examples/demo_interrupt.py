@@ -30,21 +30,15 @@ from __future__ import print_function
 import sys
 import os
 import time
-import RPi.GPIO as GPIO
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from DFRobot_CH423 import *
+from DFRobot_CH423_interrupt import CH423InterruptDispatcher, CH423GPIOChipEdgeSource
 
 ch423 = DFRobot_CH423()
 
-irq_flag = False     # INT interrupt sign
-irq_enable = True    # External interrupt enable flag bit
 INT_PIN = 27         # The digital pin of raspberry pi in BCM code, which is connected to the INT pin of sensor
 
-def notify_fun(index):
-  global irq_flag
-  irq_flag = True
-
 def func(pin):
   description = ch423.gpio_pin_description(gpio = pin)
   print("%s Interruption occurs!"%description)
@@ -86,13 +80,12 @@ if __name__ == "__main__":
   ch423.gpio_attach_interrupt(gpio = ch423.eGPIO7, mode = ch423.eCHANGE, callback = func)
   ch423.enable_interrupt()
 
-  GPIO.setmode(GPIO.BCM)
-  GPIO.setwarnings(False)
-  GPIO.setup(INT_PIN, GPIO.IN)
-  GPIO.add_event_detect(INT_PIN, GPIO.FALLING, notify_fun)
+  '''!
+    @brief The dispatcher thread sleeps until pin GPO15 outputs a falling edge, then polls the interrupts and runs the callbacks
+  '''
+  dispatcher = CH423InterruptDispatcher(ch423, CH423GPIOChipEdgeSource(line = INT_PIN))
+  dispatcher.start()
 
   while True:
-    if irq_flag:
-      irq_flag = False
-      ch423.poll_interrupts()
+    time.sleep(1)
       
@@ -0,0 +1,41 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file demo_sequencer.py
+  @brief This demo plays the water lamp effect on GPO0~GPO15 with the background pattern sequencer, the main thread stays free.
+  @note 16 LED lamps need to be connected to GPO0~GPO15 group pins
+ 
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from DFRobot_CH423 import *
+from DFRobot_CH423_output import CH423Sequencer
+
+STEP_TIME = 0.2      # Time each lamp stays on, in seconds
+
+ch423 = DFRobot_CH423()
+
+if __name__ == "__main__":
+  ch423.begin()
+  ch423.pin_mode(ch423.eGPO, ch423.ePUSH_PULL)
+
+  '''!
+    @brief Each step is a (duration, frame) pair, frame bit8~bit23 correspond to GPO0~GPO15
+  '''
+  steps = [(STEP_TIME, 1 << (8 + i)) for i in range(16)]
+
+  sequencer = CH423Sequencer(ch423, mask = ch423.MASK_GPO0_7 | ch423.MASK_GPO8_15)
+  sequencer.play(steps, loop = True)
+
+  while True:
+    time.sleep(5)
+    print(sequencer.get_stats())
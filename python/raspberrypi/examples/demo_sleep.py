@@ -29,53 +29,35 @@ from __future__ import print_function
 import sys
 import os
 import time
-import RPi.GPIO as GPIO
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 from DFRobot_CH423 import *
+from DFRobot_CH423_interrupt import CH423InterruptDispatcher, CH423GPIOChipEdgeSource
+from DFRobot_CH423_power import CH423PowerManager
 
 ch423 = DFRobot_CH423()
 
-irq_flag = False     # INT interrupt sign
 INT_PIN = 27         # The digital pin of raspberry pi in BCM code, which is connected to the INT pin of sensor
-wakeup_flag = False  # Wake up flag bit
-WAKING_TIME = 3      # Enter sleep mode again after waking up for 3s
+IDLE_TIME = 3        # Enter sleep mode again after 3s without pin operation or interrupt
 
-def notify_fun(index):
-  global irq_flag
-  irq_flag = True
+def wakeup_fun(index):
+  print("Waking up by GPIO%d..."%index)
 
 if __name__ == "__main__":
   ch423.begin()
 
   ch423.pin_mode(ch423.eGPIO, ch423.eINPUT)
 
-  ch423.gpio_attach_interrupt(gpio = ch423.eGPIO_TOTAL, mode = ch423.eFALLING, callback = 0)
+  ch423.gpio_attach_interrupt(gpio = ch423.eGPIO_TOTAL, mode = ch423.eFALLING, callback = wakeup_fun)
   ch423.enable_interrupt()
 
-  GPIO.setmode(GPIO.BCM)
-  GPIO.setwarnings(False)
-  GPIO.setup(INT_PIN, GPIO.IN)
-  GPIO.add_event_detect(INT_PIN, GPIO.FALLING, notify_fun)
-  
-  # enter sleep mode
-  ch423.sleep() 
-  print("Sleeping...")
-  
-  # Record program runtime
-  t = 0
+  dispatcher = CH423InterruptDispatcher(ch423, CH423GPIOChipEdgeSource(line = INT_PIN))
+  dispatcher.start()
+
+  # the power manager puts the module to sleep after IDLE_TIME seconds without activity, it wakes up by itself
+  power = CH423PowerManager(ch423, idle_time = IDLE_TIME)
+  power.start()
 
   while True:
-    if irq_flag:
-      irq_flag = False
-      if wakeup_flag != True:
-        print("Waking up...")
-      
-      wakeup_flag = True
-      t = time.time()
-      #print(t)
-    
-    if wakeup_flag and time.time() - t > WAKING_TIME:
-      wakeup_flag = False
-      ch423.sleep() 
-      print("Sleeping...\n\n")
+    time.sleep(5)
+    print(power.get_stats())
@@ -0,0 +1,1234 @@
+# -*- coding:utf-8 -*-
+
+'''!
+  @file test_DFRobot_CH423.py
+  @brief Tests of the driver against CH423Simulator, no hardware needed:
+  @n    python -m pytest test_DFRobot_CH423.py
+  @n    python -m unittest test_DFRobot_CH423
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import os
+import sys
+import time
+import errno
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from DFRobot_CH423 import *
+import DFRobot_CH423_transport
+from DFRobot_CH423_transport import SMBusPool, SMBusTransport
+from DFRobot_CH423_simulator import CH423Simulator
+from DFRobot_CH423_input import CH423Debouncer, CH423Sampler, CH423SampleBlock, CH423EdgeCounter
+from DFRobot_CH423_compat import monotonic_ns
+from DFRobot_CH423_group import CH423Group
+from DFRobot_CH423_trace import CH423TraceReader
+from DFRobot_CH423_power import CH423PowerManager
+from DFRobot_CH423_output import CH423Sequencer, CH423PWM
+from DFRobot_CH423_interrupt import CH423EdgeSource, CH423SimulatedEdgeSource, CH423InterruptDispatcher
+from DFRobot_CH423_interrupt import CH423CallbackPool, CH423EventRing
+try:
+  import asyncio
+  from DFRobot_CH423_async import AsyncCH423, CH423Worker
+except (ImportError, SyntaxError):
+  # the asyncio front-end is Python 3 only
+  AsyncCH423 = None
+
+ARGS  = DFRobot_CH423.CH423_CMD_SET_SYSTEM_ARGS
+GPO_L = DFRobot_CH423.CH423_CMD_SET_GPO_L
+GPO_H = DFRobot_CH423.CH423_CMD_SET_GPO_H
+GPIO  = DFRobot_CH423.CH423_CMD_SET_GPIO
+READ  = DFRobot_CH423.CH423_CMD_READ_GPIO
+IO_EN = 1 << DFRobot_CH423.ARGS_BIT_IO_EN
+INT_EN = 1 << DFRobot_CH423.ARGS_BIT_INT_EN
+DEC_L = 1 << DFRobot_CH423.ARGS_BIT_DEC_L
+DEC_H = 1 << DFRobot_CH423.ARGS_BIT_DEC_H
+
+
+def wait_for(condition, timeout = 2.0):
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() > deadline:
+      return False
+    time.sleep(0.001)
+  return True
+
+
+class LoggingSimulator(CH423Simulator):
+  '''!
+    @brief Simulator remembering the order of the writes
+  '''
+  def __init__(self, *args, **kwargs):
+    self.log = []
+    CH423Simulator.__init__(self, *args, **kwargs)
+
+  def write_byte(self, cmd, value):
+    CH423Simulator.write_byte(self, cmd, value)
+    self.log.append((cmd, value))
+
+
+class FakeSMBus(object):
+  '''!
+    @brief smbus.SMBus stand-in recording the writes of every handle opened in the process
+  '''
+  opened = []
+
+  def __init__(self, bus):
+    self.bus    = bus
+    self.log    = []
+    self.closed = False
+    FakeSMBus.opened.append(self)
+
+  def write_byte(self, cmd, value):
+    self.log.append((cmd, value))
+
+  def read_byte(self, cmd):
+    return 0xFF
+
+  def close(self):
+    self.closed = True
+
+
+class FakeSMBusModule(object):
+  SMBus = FakeSMBus
+
+
+class FakeFcntl(object):
+  '''!
+    @brief fcntl stand-in decoding I2C_RDWR transfers, or failing them with error
+  '''
+  def __init__(self, error = None):
+    self.error     = error
+    self.transfers = []
+
+  def ioctl(self, fd, request, arg):
+    if self.error is not None:
+      raise IOError(self.error, os.strerror(self.error))
+    self.transfers.append([(arg.msgs[i].addr, arg.msgs[i].buf[0]) for i in range(arg.nmsgs)])
+
+
+class FakePool(SMBusPool):
+  def fileno(self, bus):
+    return -1
+
+
+class SMBusTestCase(unittest.TestCase):
+  def setUp(self):
+    self.saved = (DFRobot_CH423_transport.smbus, DFRobot_CH423_transport.fcntl)
+    DFRobot_CH423_transport.smbus = FakeSMBusModule
+    del FakeSMBus.opened[:]
+
+  def tearDown(self):
+    DFRobot_CH423_transport.smbus, DFRobot_CH423_transport.fcntl = self.saved
+
+  def transport(self, error = None):
+    self.fcntl = DFRobot_CH423_transport.fcntl = FakeFcntl(error)
+    return SMBusTransport(1, FakePool())
+
+
+class DriverTestCase(unittest.TestCase):
+  def make(self, gpio_mode = DFRobot_CH423.eINPUT, inputs = 0xFF):
+    self.sim = LoggingSimulator(inputs = inputs)
+    self.dev = DFRobot_CH423(transport = self.sim)
+    self.dev.begin(gpio_mode)
+    del self.sim.log[:]
+    self.sim.reset_counters()
+    return self.dev
+
+
+class TestBatch(DriverTestCase):
+  def test_one_write_per_register(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    with dev.batch():
+      for gpo in range(16):
+        dev.gpo_digital_write(gpo, 1)
+      dev.gpio_digital_write(DFRobot_CH423.eGPIO0, 0)
+    self.assertEqual(sorted(self.sim.log), [(GPO_L, 0xFF), (GPO_H, 0xFF), (GPIO, 0xFE)])
+
+  def test_data_before_args(self):
+    dev = self.make(DFRobot_CH423.eINPUT)
+    with dev.batch():
+      dev.pin_mode(DFRobot_CH423.eGPIO, DFRobot_CH423.eOUTPUT)
+      dev.gpio_digital_write(DFRobot_CH423.eGPIO_TOTAL, 0x0F)
+    self.assertEqual(self.sim.log, [(GPIO, 0x0F), (ARGS, IO_EN)])
+
+  def test_args_first_when_output_turns_off(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    with dev.batch():
+      dev.pin_mode(DFRobot_CH423.eGPIO, DFRobot_CH423.eINPUT)
+      dev.gpio_digital_write(DFRobot_CH423.eGPIO_TOTAL, 0x00)
+    self.assertEqual(self.sim.log, [(ARGS, 0), (GPIO, 0x00)])
+
+  def test_nested_batch_flushes_once(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    with dev.batch():
+      with dev.batch():
+        dev.gpo_digital_write(0, 1)
+      self.assertEqual(self.sim.log, [])
+      dev.gpo_digital_write(1, 1)
+    self.assertEqual(self.sim.log, [(GPO_L, 0x03)])
+
+
+class TestCombinedWrites(SMBusTestCase):
+  def test_one_transfer_per_batch(self):
+    bus = self.transport()
+    dev = DFRobot_CH423(transport = bus)
+    dev.begin(dev.eOUTPUT)
+    del self.fcntl.transfers[:]
+    with dev.batch():
+      dev.gpo_digital_write(dev.eGPO0, 1)
+      dev.gpo_digital_write(dev.eGPO8, 1)
+      dev.gpio_digital_write(dev.eGPIO0, 0)
+    self.assertEqual(self.fcntl.transfers, [[(GPO_L, 0x01), (GPO_H, 0x01), (GPIO, 0xFE)]])
+
+  def test_single_register_uses_write_byte(self):
+    bus = self.transport()
+    dev = DFRobot_CH423(transport = bus)
+    dev.begin(dev.eOUTPUT)
+    del self.fcntl.transfers[:]
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    self.assertEqual(self.fcntl.transfers, [])
+    self.assertEqual(FakeSMBus.opened[0].log[-1], (GPO_L, 0x01))
+
+  def test_long_sequence_split(self):
+    bus = self.transport()
+    bus.write_bytes([(GPO_L, i) for i in range(50)])
+    self.assertEqual([len(t) for t in self.fcntl.transfers], [SMBusTransport.I2C_RDWR_MAX_MSGS, 50 - SMBusTransport.I2C_RDWR_MAX_MSGS])
+
+  def test_fallback_without_rdwr(self):
+    bus = self.transport(errno.ENOTTY)
+    bus.write_bytes([(GPO_L, 1), (GPO_H, 2)])
+    self.fcntl.error = None
+    bus.write_bytes([(GPIO, 3), (GPO_L, 4)])
+    self.assertEqual(self.fcntl.transfers, [])
+    self.assertEqual(FakeSMBus.opened[0].log, [(GPO_L, 1), (GPO_H, 2), (GPIO, 3), (GPO_L, 4)])
+
+  def test_other_errors_raised(self):
+    bus = self.transport(errno.EIO)
+    self.assertRaises(IOError, bus.write_bytes, [(GPO_L, 1), (GPO_H, 2)])
+    self.assertEqual(FakeSMBus.opened[0].log, [])
+
+
+class TestSMBusPool(SMBusTestCase):
+  BUS = 7
+
+  def open_buses(self):
+    return SMBusTransport(self.BUS).pool.get_open_buses()
+
+  def test_opened_by_first_access(self):
+    dev = DFRobot_CH423(bus = self.BUS)
+    self.assertEqual(FakeSMBus.opened, [])
+    dev.begin()
+    self.assertEqual([h.bus for h in FakeSMBus.opened], [self.BUS])
+    dev.close()
+
+  def test_drivers_share_one_handle(self):
+    devs = [DFRobot_CH423(bus = self.BUS) for i in range(3)]
+    for dev in devs:
+      dev.begin()
+    self.assertEqual(len(FakeSMBus.opened), 1)
+    self.assertEqual(self.open_buses(), {self.BUS: 3})
+    devs[0].close()
+    devs[0].close()
+    self.assertEqual(self.open_buses(), {self.BUS: 2})
+    devs[1].close()
+    self.assertFalse(FakeSMBus.opened[0].closed)
+    devs[2].close()
+    self.assertTrue(FakeSMBus.opened[0].closed)
+    self.assertEqual(self.open_buses(), {})
+
+  def test_reopen_after_close(self):
+    dev = DFRobot_CH423(bus = self.BUS)
+    dev.begin(dev.eOUTPUT)
+    dev.close()
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    self.assertEqual(len(FakeSMBus.opened), 2)
+    self.assertEqual(FakeSMBus.opened[1].log, [(GPO_L, 0x01)])
+    self.assertEqual(self.open_buses(), {self.BUS: 1})
+    dev.close()
+    self.assertEqual(self.open_buses(), {})
+
+  def test_given_transport_stays_open(self):
+    bus = SMBusTransport(self.BUS)
+    dev = DFRobot_CH423(transport = bus)
+    dev.begin()
+    dev.close()
+    self.assertEqual(self.open_buses(), {self.BUS: 1})
+    bus.close()
+    self.assertEqual(self.open_buses(), {})
+
+  def test_pools_separate(self):
+    pool = SMBusPool()
+    bus  = SMBusTransport(self.BUS, pool)
+    bus.write_byte(GPO_L, 1)
+    self.assertEqual(pool.get_open_buses(), {self.BUS: 1})
+    self.assertEqual(self.open_buses(), {})
+    bus.close()
+
+
+class TestSkipAndForce(DriverTestCase):
+  def test_unchanged_write_is_skipped(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.gpo_digital_write(3, 1)
+    dev.gpo_digital_write(3, 1)
+    self.assertEqual(self.sim.log, [(GPO_L, 0x08)])
+    self.assertEqual(dev.get_skipped_writes(), 1)
+
+  def test_force_writes_again(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.gpo_digital_write(3, 1)
+    dev.gpo_digital_write(3, 1, force = True)
+    self.assertEqual(self.sim.log, [(GPO_L, 0x08), (GPO_L, 0x08)])
+
+  def test_batch_back_to_old_value_writes_nothing(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.gpo_digital_write(9, 0)
+    del self.sim.log[:]
+    with dev.batch():
+      dev.gpo_digital_write(9, 1)
+      dev.gpo_digital_write(9, 0)
+    self.assertEqual(self.sim.log, [])
+
+
+class TestBegin(DriverTestCase):
+  def test_gpio_shadow_ignores_pin_levels(self):
+    # a pin held low from outside must not end up in the output latch
+    dev = self.make(DFRobot_CH423.eINPUT, inputs = 0xFE)
+    dev.pin_mode(DFRobot_CH423.eGPIO, DFRobot_CH423.eOUTPUT)
+    dev.gpio_digital_write(DFRobot_CH423.eGPIO7, 0)
+    self.assertEqual(self.sim.gpio_latch, 0x7F)
+
+
+class TestInterruptReference(DriverTestCase):
+  def reference(self, mode):
+    dev = self.make()
+    dev.gpio_attach_interrupt(DFRobot_CH423.eGPIO0, mode, None)
+    dev.enable_interrupt()
+    return self.sim.gpio_latch & 1
+
+  def test_high_and_rising_compare_with_low(self):
+    self.assertEqual(self.reference(DFRobot_CH423.eHIGH), 0)
+    self.assertEqual(self.reference(DFRobot_CH423.eRISING), 0)
+
+  def test_low_and_falling_compare_with_high(self):
+    self.assertEqual(self.reference(DFRobot_CH423.eLOW), 1)
+    self.assertEqual(self.reference(DFRobot_CH423.eFALLING), 1)
+
+  def test_change_rearms_and_calls_back(self):
+    dev = self.make()
+    pins = []
+    dev.gpio_attach_interrupt(DFRobot_CH423.eGPIO2, DFRobot_CH423.eCHANGE, pins.append)
+    dev.enable_interrupt()
+    self.sim.set_input(2, 0)
+    self.assertEqual(self.sim.int_level(), 0)
+    dev.poll_interrupts()
+    self.assertEqual(pins, [2])
+    self.assertEqual(self.sim.int_level(), 1)
+    dev.poll_interrupts()
+    self.assertEqual(pins, [2])
+
+
+class TestRecovery(DriverTestCase):
+  def test_restore_after_reset(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.group_digital_write(DFRobot_CH423.eGPO0_7, 0x5A)
+    dev.group_digital_write(DFRobot_CH423.eGPO8_15, 0xA500)
+    dev.gpio_digital_write(DFRobot_CH423.eGPIO_TOTAL, 0x3C)
+    del self.sim.log[:]
+    self.sim.fail(1, reset = True)
+    dev.gpo_digital_write(DFRobot_CH423.eGPO0, 1)
+    self.assertEqual(self.sim.log, [(ARGS, IO_EN), (GPO_L, 0x5B), (GPO_H, 0xA5), (GPIO, 0x3C)])
+    stats = dev.get_recovery_stats()
+    self.assertEqual((stats["errors"], stats["recoveries"], stats["failed"]), (1, 1, 0))
+
+  def test_failed_read_is_repeated(self):
+    dev = self.make(inputs = 0xC3)
+    self.sim.fail(1)
+    self.assertEqual(dev.gpio_digital_read(DFRobot_CH423.eGPIO_TOTAL), 0xC3)
+
+  def test_error_raised_after_last_retry(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.set_retry(2, backoff = 0)
+    self.sim.fail(10)
+    self.assertRaises(IOError, dev.gpo_digital_write, 0, 1)
+    stats = dev.get_recovery_stats()
+    self.assertEqual((stats["errors"], stats["retries"], stats["failed"]), (3, 2, 1))
+
+  def test_no_retry(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.set_retry(0)
+    self.sim.fail(1)
+    self.assertRaises(IOError, dev.gpo_digital_write, 0, 1)
+    self.assertEqual(dev.get_recovery_stats()["retries"], 0)
+
+
+class TestDebouncer(unittest.TestCase):
+  def test_change_needs_consecutive_samples(self):
+    deb = CH423Debouncer(samples = 3)
+    deb.reset(0xFF)
+    self.assertEqual(deb.update(0xFE), 0xFF)
+    self.assertEqual(deb.update(0xFE), 0xFF)
+    self.assertEqual(deb.pending, 0x01)
+    self.assertEqual(deb.update(0xFE), 0xFE)
+    self.assertEqual(deb.pending, 0)
+
+  def test_bounce_restarts_count(self):
+    deb = CH423Debouncer(samples = 3)
+    deb.reset(0xFF)
+    deb.update(0xFE)
+    deb.update(0xFE)
+    deb.update(0xFF)
+    self.assertEqual(deb.update(0xFE), 0xFF)
+    self.assertEqual(deb.update(0xFE), 0xFF)
+    self.assertEqual(deb.update(0xFE), 0xFE)
+
+  def test_pins_count_independently(self):
+    deb = CH423Debouncer(samples = 2)
+    deb.set_samples(DFRobot_CH423.eGPIO7, 4)
+    deb.reset(0x00)
+    levels = [deb.update(0x81) for i in range(4)]
+    self.assertEqual(levels, [0x00, 0x01, 0x01, 0x81])
+
+
+class TestMasks(DriverTestCase):
+  def test_only_registers_of_masked_pins_written(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.write_masked(0x000100, 0xFFFFFF)
+    self.assertEqual(self.sim.log, [(GPO_L, 0x01)])
+    del self.sim.log[:]
+    dev.write_masked(0x8000FF, 0x80005A)
+    self.assertEqual(sorted(self.sim.log), sorted([(GPIO, 0x5A), (GPO_H, 0x80)]))
+    self.assertEqual(dev.get_outputs(), 0x80015A)
+
+  def test_set_and_clear(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.clear_mask(DFRobot_CH423.MASK_ALL)
+    dev.set_mask(0x010203)
+    self.assertEqual(dev.get_outputs(), 0x010203)
+    dev.clear_mask(0x000201)
+    self.assertEqual(dev.get_outputs(), 0x010002)
+    self.assertEqual((self.sim.gpio_latch, self.sim.gpo_l, self.sim.gpo_h), (0x02, 0x00, 0x01))
+
+  def test_toggle(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.write_masked(DFRobot_CH423.MASK_ALL, 0x00FF0F)
+    del self.sim.log[:]
+    dev.toggle_mask(0x000F00)
+    self.assertEqual(self.sim.log, [(GPO_L, 0xF0)])
+    dev.toggle_mask(0x000F00)
+    self.assertEqual(dev.get_outputs(), 0x00FF0F)
+
+  def test_toggle_in_batch_sees_earlier_writes(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    with dev.batch():
+      dev.gpo_digital_write(dev.eGPO0, 1)
+      dev.toggle_mask(0x000300)
+    self.assertEqual(self.sim.gpo_l, 0x02)
+    self.assertEqual(self.sim.log, [(GPO_L, 0x02)])
+
+  def test_mask_out_of_range(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    self.assertIsNone(dev.write_masked(0x1000000, 0))
+    self.assertEqual(self.sim.log, [])
+
+
+class TestEdgeCounter(unittest.TestCase):
+  LEVELS = [0x00, 0x03, 0x01, 0x00, 0x02]
+  COUNTS = {DFRobot_CH423.eRISING: [1, 2], DFRobot_CH423.eFALLING: [1, 1], DFRobot_CH423.eCHANGE: [2, 3]}
+
+  def block(self, levels, start = 0, step = 1000):
+    block = CH423SampleBlock(len(levels))
+    for i, level in enumerate(levels):
+      block.levels[i]     = level
+      block.timestamps[i] = start + i * step
+    block.length = len(levels)
+    return block
+
+  def test_feed(self):
+    for edge, counts in self.COUNTS.items():
+      counter = CH423EdgeCounter(edge)
+      for i, level in enumerate(self.LEVELS):
+        counter.feed(level, i * 1000)
+      self.assertEqual(counter.counts(), counts + [0]*6)
+
+  def test_feed_block(self):
+    for edge, counts in self.COUNTS.items():
+      counter = CH423EdgeCounter(edge)
+      counter.feed_block(self.block(self.LEVELS[:2]))
+      counter.feed_block(self.block(self.LEVELS[2:], 2000))
+      self.assertEqual(counter.counts(), counts + [0]*6)
+
+  def test_window_frequency(self):
+    # GPIO0 toggles every 5 samples of 10 ms (10 Hz); the window closes less than 1 s ago, so frequencies() keeps it
+    start  = monotonic_ns() - 1500000000
+    levels = [(k // 5) & 1 for k in range(121)]
+    for edge in (DFRobot_CH423.eRISING, DFRobot_CH423.eCHANGE):
+      counter = CH423EdgeCounter(edge, window = 1.0)
+      counter.feed_block(self.block(levels, start, 10000000))
+      freqs = counter.frequencies()
+      self.assertAlmostEqual(freqs[0], 10.0)
+      counter = CH423EdgeCounter(edge, window = 1.0)
+      for k, level in enumerate(levels):
+        counter.feed(level, start + k * 10000000)
+      freqs = counter.frequencies()
+      self.assertAlmostEqual(freqs[0], 10.0)
+      self.assertEqual(freqs[1:], [0.0]*7)
+      self.assertAlmostEqual(counter.periods()[0], 0.1)
+      self.assertIsNone(counter.periods()[1])
+
+  def test_reset(self):
+    counter = CH423EdgeCounter(DFRobot_CH423.eCHANGE)
+    counter.feed_block(self.block(self.LEVELS))
+    counter.reset()
+    self.assertEqual(counter.counts(), [0]*8)
+
+
+class TestSequencer(DriverTestCase):
+  def make_outputs(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.clear_mask(DFRobot_CH423.MASK_ALL)
+    del self.sim.log[:]
+    return dev
+
+  def test_only_changed_registers_written(self):
+    dev = self.make_outputs()
+    seq = CH423Sequencer(dev)
+    seq.play([(0.001, 0x000100), (0.001, 0x000300), (0.001, 0x010300), (0.001, 0x010300)])
+    self.assertTrue(seq.wait(2.0))
+    self.assertEqual(self.sim.log, [(GPO_L, 0x01), (GPO_L, 0x03), (GPO_H, 0x01)])
+    self.assertEqual(seq.get_stats()["frames"], 4)
+
+  def test_mask_limits_pins(self):
+    dev = self.make_outputs()
+    seq = CH423Sequencer(dev, mask = DFRobot_CH423.MASK_GPO0_7)
+    seq.play([(0.001, 0xFFFFFF)])
+    self.assertTrue(seq.wait(2.0))
+    self.assertEqual(self.sim.log, [(GPO_L, 0xFF)])
+
+  def test_swap_at_frame_boundary(self):
+    dev = self.make_outputs()
+    seq = CH423Sequencer(dev)
+    seq.play([(0.002, 0x000100), (0.002, 0x000000)], loop = True)
+    self.assertTrue(wait_for(lambda: seq.get_stats()["frames"] >= 3))
+    seq.swap([(0.001, 0x000200)])
+    self.assertTrue(seq.wait(2.0))
+    self.assertEqual(dev.get_outputs(), 0x000200)
+    self.assertEqual(self.sim.log[-1], (GPO_L, 0x02))
+
+  def test_stop_keeps_last_frame(self):
+    dev = self.make_outputs()
+    seq = CH423Sequencer(dev)
+    seq.play([(10, 0x000080)])
+    self.assertTrue(wait_for(lambda: seq.get_stats()["frames"] == 1))
+    seq.stop()
+    self.assertFalse(seq.is_running())
+    self.assertEqual(dev.get_outputs(), 0x000080)
+
+
+class TestPWM(DriverTestCase):
+  def make_pwm(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.clear_mask(DFRobot_CH423.MASK_ALL)
+    return CH423PWM(dev, frequency = 200)
+
+  def test_one_slot_per_switching_time(self):
+    pwm = self.make_pwm()
+    pwm.set_duties({0: 0.25, 1: 0.25, 2: 0.5, 3: 1.0, 4: 0.0})
+    pwm.get_max_frequency()
+    self.assertEqual(pwm.get_stats()["slots"], 3)
+    pwm.set_duty(1, 0.75)
+    pwm.get_max_frequency()
+    self.assertEqual(pwm.get_stats()["slots"], 4)
+    pwm.release(1)
+    pwm.get_max_frequency()
+    self.assertEqual(pwm.get_stats()["slots"], 3)
+
+  def test_frames_written(self):
+    pwm = self.make_pwm()
+    pwm.set_duties({0: 0.5, 1: 1.0, 2: 0.0})
+    pwm.calibrate()
+    del self.sim.log[:]
+    pwm.start()
+    self.assertTrue(wait_for(lambda: pwm.get_stats()["periods"] >= 4))
+    pwm.stop()
+    self.assertEqual(set(self.sim.log), set([(GPO_L, 0x03), (GPO_L, 0x02)]))
+
+  def test_released_pin_not_driven(self):
+    pwm = self.make_pwm()
+    pwm.set_duties({0: 0.5, 8: 0.5})
+    pwm.release(8)
+    pwm.calibrate()
+    del self.sim.log[:]
+    pwm.start()
+    self.assertTrue(wait_for(lambda: pwm.get_stats()["periods"] >= 2))
+    pwm.stop()
+    self.assertNotIn(GPO_H, [cmd for cmd, value in self.sim.log])
+
+  def test_duty_range(self):
+    pwm = self.make_pwm()
+    self.assertIsNone(pwm.set_duty(16, 0.5))
+    pwm.set_duty(0, 1.5)
+    self.assertEqual(pwm.get_duty(0), 1.0)
+
+
+class TestStats(DriverTestCase):
+  def test_counts(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.enable_stats()
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    dev.gpo_digital_write(dev.eGPO0, 0)
+    dev.gpo_digital_write(dev.eGPO0, 0)
+    dev.set_mask(0x000600)
+    dev.gpio_digital_read(dev.eGPIO0)
+    stats = dev.get_stats()
+    self.assertEqual(stats["methods"], {"gpo_digital_write": 3, "set_mask": 1, "write_masked": 1, "gpio_digital_read": 1})
+    self.assertEqual(stats["transactions"], 4)
+    self.assertEqual(stats["errors"], 0)
+    commands = stats["commands"]
+    self.assertEqual(sorted(commands), [GPO_L, READ])
+    self.assertEqual((commands[GPO_L]["writes"], commands[READ]["reads"]), (3, 1))
+    self.assertEqual(sum(commands[GPO_L]["hist"]), 3)
+
+  def test_combined_write_is_one_transaction(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.enable_stats()
+    dev.write_masked(0xFFFF00, 0x010100)
+    stats = dev.get_stats()
+    self.assertEqual(stats["transactions"], 1)
+    self.assertEqual(stats["commands"][GPO_L]["bytes"] + stats["commands"][GPO_H]["bytes"], 2)
+
+  def test_errors_counted(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.enable_stats()
+    self.sim.fail(1)
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    stats = dev.get_stats()
+    self.assertEqual(stats["errors"], 1)
+    self.assertEqual(stats["commands"][GPO_L]["writes"], 2)
+
+  def test_reset_and_disable(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    monitor = dev.enable_stats()
+    self.assertIs(dev.enable_stats(), monitor)
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    dev.reset_stats()
+    stats = dev.get_stats()
+    self.assertEqual((stats["transactions"], stats["methods"], stats["commands"]), (0, {}, {}))
+    dev.disable_stats()
+    self.assertIsNone(dev.get_stats())
+    self.assertNotIn("gpo_digital_write", vars(dev))
+    dev.gpo_digital_write(dev.eGPO0, 0)
+    self.assertEqual(self.sim.gpo_l, 0)
+    self.assertEqual(monitor.get_stats()["transactions"], 0)
+
+
+class TestTrace(DriverTestCase):
+  def setUp(self):
+    self.dir  = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, "capture.trace")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def capture(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT, inputs = 0x3C)
+    dev.start_trace(self.path, buffer_size = 14)
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    dev.gpo_digital_write(dev.eGPO0, 1, force = True)
+    dev.write_masked(0xFFFF00, 0x800100)
+    dev.pin_mode(dev.eGPIO, dev.eINPUT)
+    self.sim.fail(1)
+    dev.gpio_digital_read(dev.eGPIO_TOTAL)
+    dev.stop_trace()
+    return dev
+
+  def test_round_trip(self):
+    self.capture()
+    ops = [(cmd, value, read, error) for stamp, cmd, value, read, error in CH423TraceReader(self.path)]
+    restore = [(ARGS, 0x00, False, False), (GPO_L, 0x01, False, False), (GPO_H, 0x80, False, False), (GPIO, 0xFF, False, False)]
+    self.assertEqual(ops, [(GPO_L, 0x01, False, False), (GPO_L, 0x01, False, False), (GPO_H, 0x80, False, False),
+                           (ARGS, 0x00, False, False), (READ, 0, True, True)] + restore + [(READ, 0x3C, True, False)])
+    stamps = [op[0] for op in CH423TraceReader(self.path)]
+    self.assertEqual(stamps, sorted(stamps))
+
+  def test_summary(self):
+    self.capture()
+    summary = CH423TraceReader(self.path).summary()
+    self.assertEqual((summary["transactions"], summary["reads"], summary["writes"], summary["errors"]), (10, 2, 8, 1))
+    # the forced write and the restore after the failed read repeat values
+    self.assertEqual(summary["redundant_writes"], 4)
+    self.assertEqual(summary["commands"], {GPO_L: 3, GPO_H: 2, ARGS: 2, GPIO: 1, READ: 2})
+
+  def test_replay(self):
+    self.capture()
+    target = CH423Simulator()
+    result = CH423TraceReader(self.path).replay(target, speed = 0)
+    self.assertEqual((result["operations"], result["mismatches"]), (9, 0))
+    self.assertEqual((target.args, target.gpo_l, target.gpo_h), (self.sim.args, self.sim.gpo_l, self.sim.gpo_h))
+    self.assertEqual(target.inputs, 0x3C)
+
+  def test_stop_restores_transport(self):
+    dev = self.capture()
+    records = os.path.getsize(self.path)
+    dev.gpo_digital_write(dev.eGPO1, 1)
+    self.assertEqual(os.path.getsize(self.path), records)
+    self.assertEqual(self.sim.gpo_l, 0x03)
+
+  def test_not_a_trace(self):
+    with open(self.path, "wb") as f:
+      f.write(b"something else")
+    self.assertRaises(ValueError, CH423TraceReader, self.path)
+
+
+class TestGroup(unittest.TestCase):
+  def setUp(self):
+    self.sims  = [LoggingSimulator(inputs = 0xF0 | i) for i in range(3)]
+    self.group = CH423Group([DFRobot_CH423(transport = sim) for sim in self.sims])
+    self.group.begin(DFRobot_CH423.eOUTPUT)
+    self.group.write_all(0)
+    for sim in self.sims:
+      del sim.log[:]
+
+  def tearDown(self):
+    self.group.close()
+
+  def test_boards_of_empty_masks_not_written(self):
+    self.group.set_mask((1 << 8) | (1 << (2 * 24 + 16)))
+    self.assertEqual([sim.log for sim in self.sims], [[(GPO_L, 0x01)], [], [(GPO_H, 0x01)]])
+    self.assertEqual(self.group.get_outputs(), (1 << 8) | (1 << (2 * 24 + 16)))
+
+  def test_value_split_per_board(self):
+    self.group.write_masked(0xFFFFFF << 24, 0x123456 << 24)
+    self.assertEqual(self.group.devices[1].get_outputs(), 0x123456)
+    self.assertEqual(self.group.devices[0].get_outputs(), 0)
+    self.group.clear_mask(0x000400 << 24)
+    self.assertEqual(self.group.devices[1].get_outputs(), 0x123056)
+
+  def test_pin_write(self):
+    self.group.pin_write(24 + 9, 1)
+    self.assertEqual(self.sims[1].log, [(GPO_L, 0x02)])
+    self.group.pin_write(24 + 9, 0)
+    self.assertEqual(self.group.get_outputs(), 0)
+
+  def test_write_all(self):
+    self.group.write_all(0x800001)
+    self.assertEqual([(sim.gpio_latch, sim.gpo_h) for sim in self.sims], [(0x01, 0x80)]*3)
+
+  def test_masks_past_last_board_ignored(self):
+    self.group.set_mask(1 << (3 * 24))
+    self.assertEqual([sim.log for sim in self.sims], [[], [], []])
+
+  def test_read_inputs(self):
+    self.group.call_all("pin_mode", DFRobot_CH423.eGPIO, DFRobot_CH423.eINPUT)
+    self.assertEqual(self.group.read_inputs(), [0xF0, 0xF1, 0xF2])
+
+
+class TestLocking(DriverTestCase):
+  def callback_threads(self):
+    return [t for t in threading.enumerate() if t.name.startswith("CH423Callback-")]
+
+  def test_concurrent_pool_enable_leaks_no_pool(self):
+    dev = self.make()
+    start = threading.Event()
+    def enable():
+      start.wait()
+      for i in range(5):
+        dev.enable_callback_pool(workers = 1)
+    threads = [threading.Thread(target = enable) for i in range(4)]
+    for t in threads:
+      t.start()
+    start.set()
+    for t in threads:
+      t.join()
+    self.assertEqual(len(self.callback_threads()), 1)
+    dev.disable_callback_pool()
+    self.assertEqual(self.callback_threads(), [])
+
+  def test_pool_closed_while_callbacks_use_driver(self):
+    dev = self.make()
+    called = []
+    def callback(pin):
+      time.sleep(0.01)
+      dev.gpo_digital_write(dev.eGPO0, 1)
+      called.append(pin)
+    dev.gpio_attach_interrupt(dev.eGPIO0, dev.eFALLING, callback)
+    dev.enable_interrupt()
+    dev.enable_callback_pool()
+    self.sim.set_input(dev.eGPIO0, 0)
+    dev.poll_interrupts()
+    closer = threading.Thread(target = dev.disable_callback_pool)
+    closer.start()
+    closer.join(2.0)
+    self.assertFalse(closer.is_alive())
+    self.assertEqual(called, [dev.eGPIO0])
+    self.assertEqual(self.sim.gpo_l, 0x01)
+
+  def test_concurrent_writes_keep_every_bit(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.clear_mask(DFRobot_CH423.MASK_ALL)
+    def toggle(gpo):
+      for i in range(201):
+        dev.toggle_mask(1 << (8 + gpo))
+    threads = [threading.Thread(target = toggle, args = (gpo,)) for gpo in range(16)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(dev.get_outputs(), 0xFFFF00)
+    self.assertEqual((self.sim.gpo_l, self.sim.gpo_h), (0xFF, 0xFF))
+
+
+class Gate(object):
+  '''!
+    @brief Stand-in device whose call keeps a CH423Worker busy until it is opened
+  '''
+  def __init__(self):
+    self.event = threading.Event()
+
+  def hold(self):
+    self.event.wait(2.0)
+
+
+@unittest.skipIf(AsyncCH423 is None, "asyncio front-end needs Python 3")
+class TestAsync(DriverTestCase):
+  def run_async(self, coro):
+    loop = asyncio.new_event_loop()
+    try:
+      return loop.run_until_complete(coro)
+    finally:
+      loop.close()
+
+  def test_queued_writes_merged(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.clear_mask(DFRobot_CH423.MASK_ALL)
+    del self.sim.log[:]
+    async def run():
+      worker = CH423Worker()
+      adev   = AsyncCH423(dev, worker = worker)
+      gate   = Gate()
+      held   = worker.submit(gate, "hold", (), {}, False)
+      calls  = [asyncio.ensure_future(c) for c in (adev.gpo_digital_write(adev.eGPO0, 1), adev.gpo_digital_write(adev.eGPO1, 1),
+                                                  adev.gpio_digital_write(adev.eGPIO0, 1), adev.gpo_digital_write(adev.eGPO2, 1))]
+      await asyncio.sleep(0)
+      gate.event.set()
+      await held
+      await asyncio.gather(*calls)
+      worker.close()
+    self.run_async(run())
+    self.assertEqual(sorted(self.sim.log), sorted([(GPIO, 0x01), (GPO_L, 0x07)]))
+
+  def test_read_not_merged(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    async def run():
+      async with AsyncCH423(dev) as adev:
+        await adev.gpio_digital_write(adev.eGPIO0, 0)
+        return await adev.gpio_digital_read(adev.eGPIO0)
+    self.assertEqual(self.run_async(run()), 0)
+
+  def test_events(self):
+    dev = self.make()
+    async def run():
+      async with AsyncCH423(dev) as adev:
+        await adev.gpio_attach_interrupt(adev.eGPIO2, adev.eFALLING)
+        await adev.enable_interrupt()
+        self.sim.set_input(adev.eGPIO2, 0)
+        await adev.poll_interrupts()
+        async def first():
+          async for event in adev.events():
+            return event
+        return await asyncio.wait_for(first(), 2.0)
+    event = self.run_async(run())
+    self.assertEqual(event.pin, DFRobot_CH423.eGPIO2)
+
+  def test_blocking_methods_refused(self):
+    dev = self.make()
+    worker = CH423Worker()
+    adev = AsyncCH423(dev, worker = worker)
+    self.assertEqual(adev.eGPO0, DFRobot_CH423.eGPO0)
+    self.assertRaises(AttributeError, getattr, adev, "batch")
+    worker.close()
+
+
+class TestDispatcher(DriverTestCase):
+  def test_edge_source(self):
+    source = CH423EdgeSource()
+    self.assertIsNone(source.wait_edge(0))
+    source.notify(12.5)
+    self.assertEqual(source.wait_edge(0), 12.5)
+    self.assertIsNone(source.wait_edge(0))
+
+  def test_simulated_source_follows_int(self):
+    dev = self.make()
+    dev.gpio_attach_interrupt(dev.eGPIO3, dev.eFALLING, None)
+    dev.enable_interrupt()
+    source = CH423SimulatedEdgeSource(self.sim)
+    self.sim.set_input(dev.eGPIO3, 0)
+    self.assertIsNotNone(source.wait_edge(0))
+    source.close()
+    self.sim.set_input(dev.eGPIO3, 1)
+    dev.poll_interrupts()
+    self.sim.set_input(dev.eGPIO3, 0)
+    self.assertIsNone(source.wait_edge(0))
+
+  def test_edges_run_callbacks(self):
+    dev = self.make()
+    called = []
+    dev.gpio_attach_interrupt(dev.eGPIO3, dev.eCHANGE, called.append)
+    dev.enable_interrupt()
+    dispatcher = CH423InterruptDispatcher(dev, CH423SimulatedEdgeSource(self.sim))
+    dispatcher.start()
+    try:
+      self.sim.set_input(dev.eGPIO3, 0)
+      self.assertTrue(wait_for(lambda: len(called) == 1))
+      self.sim.set_input(dev.eGPIO3, 1)
+      self.assertTrue(wait_for(lambda: len(called) == 2))
+    finally:
+      dispatcher.stop()
+    self.assertFalse(dispatcher.is_running())
+    self.assertEqual(called, [dev.eGPIO3, dev.eGPIO3])
+    stats = dispatcher.get_stats()
+    self.assertEqual(stats["edges"], 2)
+    self.assertTrue(stats["max_latency"] >= stats["avg_latency"] >= 0)
+
+
+class TestEventRing(DriverTestCase):
+  def drain_all(self, ring):
+    records = []
+    while True:
+      view = ring.drain()
+      if not len(view):
+        return records
+      records += CH423EventRing.records(view)
+
+  def test_drain_in_order(self):
+    ring = CH423EventRing(4)
+    for n in range(3):
+      ring.append(n, 1 << n, n)
+    self.assertEqual(len(ring), 3)
+    self.assertEqual(CH423EventRing.records(ring.drain(2)), [(0, 1, 0), (1, 2, 1)])
+    self.assertEqual(self.drain_all(ring), [(2, 4, 2)])
+    self.assertEqual(len(ring), 0)
+
+  def test_wrap(self):
+    ring = CH423EventRing(4)
+    for n in range(3):
+      ring.append(n, 0, 0)
+    ring.drain(2)
+    for n in range(3, 6):
+      ring.append(n, 0, 0)
+    self.assertEqual(len(ring.drain()), 2 * CH423EventRing.RECORD.size)
+    self.assertEqual([r[0] for r in CH423EventRing.records(ring.drain())], [4, 5])
+    self.assertEqual(len(ring.drain()), 0)
+
+  def test_overwrite_oldest(self):
+    ring = CH423EventRing(4)
+    for n in range(6):
+      ring.append(n, 0, 0)
+    self.assertEqual([r[0] for r in self.drain_all(ring)], [2, 3, 4, 5])
+    self.assertEqual(ring.get_stats(), {"count": 0, "appended": 6, "overwritten": 2})
+
+  def test_poll_records_interrupts(self):
+    dev = self.make()
+    ring = CH423EventRing(16)
+    dev.set_event_ring(ring)
+    dev.gpio_attach_interrupt(dev.eGPIO1, dev.eFALLING, None)
+    dev.gpio_attach_interrupt(dev.eGPIO5, dev.eFALLING, None)
+    dev.enable_interrupt()
+    self.sim.set_inputs(0xDD)
+    dev.poll_interrupts(1.5)
+    self.sim.set_inputs(0xFF)
+    dev.poll_interrupts()
+    self.assertEqual(self.drain_all(ring), [(1500000000, 0x22, 0xDD)])
+
+
+class TestCallbackPool(unittest.TestCase):
+  def setUp(self):
+    self.gate = threading.Event()
+    self.ran  = []
+
+  def hold(self, pin):
+    self.gate.wait(2.0)
+
+  def record(self, n):
+    return lambda pin: self.ran.append((pin, n))
+
+  def busy_pool(self, overflow):
+    # one worker, stuck in hold() with an empty queue of two slots
+    pool = CH423CallbackPool(workers = 1, queue_size = 2, overflow = overflow)
+    pool.submit(0, self.hold)
+    self.assertTrue(wait_for(lambda: pool.get_stats()["depth"] == 0))
+    return pool
+
+  def test_pin_order(self):
+    pool = CH423CallbackPool(workers = 2, queue_size = 256)
+    for n in range(100):
+      pool.submit(n % 4, self.record(n))
+    pool.close()
+    for pin in range(4):
+      self.assertEqual([n for p, n in self.ran if p == pin], list(range(pin, 100, 4)))
+
+  def test_drop_newest(self):
+    pool = self.busy_pool(CH423CallbackPool.DROP_NEWEST)
+    results = [pool.submit(0, self.record(n)) for n in range(3)]
+    self.gate.set()
+    pool.close()
+    self.assertEqual(results, [True, True, False])
+    self.assertEqual(self.ran, [(0, 0), (0, 1)])
+    self.assertEqual(pool.get_stats()["dropped"], 1)
+
+  def test_drop_oldest(self):
+    pool = self.busy_pool(CH423CallbackPool.DROP_OLDEST)
+    results = [pool.submit(0, self.record(n)) for n in range(3)]
+    self.gate.set()
+    pool.close()
+    self.assertEqual(results, [True, True, True])
+    self.assertEqual(self.ran, [(0, 1), (0, 2)])
+    stats = pool.get_stats()
+    self.assertEqual((stats["dropped"], stats["max_depth"]), (1, 2))
+
+  def test_block_waits_for_a_slot(self):
+    pool = self.busy_pool(CH423CallbackPool.BLOCK)
+    pool.submit(0, self.record(0))
+    pool.submit(0, self.record(1))
+    submitter = threading.Thread(target = pool.submit, args = (0, self.record(2)))
+    submitter.start()
+    time.sleep(0.02)
+    self.assertTrue(submitter.is_alive())
+    self.gate.set()
+    submitter.join(2.0)
+    pool.close()
+    self.assertEqual(self.ran, [(0, 0), (0, 1), (0, 2)])
+    self.assertEqual(pool.get_stats()["dropped"], 0)
+
+  def test_close_drops_blocked_submit(self):
+    pool = self.busy_pool(CH423CallbackPool.BLOCK)
+    pool.submit(0, self.record(0))
+    pool.submit(0, self.record(1))
+    result = []
+    submitter = threading.Thread(target = lambda: result.append(pool.submit(0, self.record(2))))
+    submitter.start()
+    time.sleep(0.02)
+    closer = threading.Thread(target = pool.close, args = (False,))
+    closer.start()
+    submitter.join(2.0)
+    self.gate.set()
+    closer.join(2.0)
+    self.assertEqual(result, [False])
+    self.assertEqual(self.ran, [])
+    self.assertEqual(pool.submit(0, self.record(3)), False)
+
+  def test_callback_errors_counted(self):
+    pool = CH423CallbackPool(workers = 1)
+    def fail(pin):
+      raise ValueError(pin)
+    stderr, sys.stderr = sys.stderr, open(os.devnull, "w")
+    try:
+      pool.submit(0, fail)
+      pool.submit(0, self.record(0))
+      pool.close()
+    finally:
+      sys.stderr.close()
+      sys.stderr = stderr
+    self.assertEqual(pool.get_stats()["errors"], 1)
+    self.assertEqual(self.ran, [(0, 0)])
+
+
+class TestSleep(DriverTestCase):
+  def test_pin_write_wakes_without_args_write(self):
+    dev = self.make()
+    dev.sleep()
+    self.assertTrue(self.sim.sleeping)
+    del self.sim.log[:]
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    self.assertFalse(self.sim.sleeping)
+    self.assertEqual(self.sim.wake_count, 1)
+    self.assertEqual(self.sim.log, [(GPO_L, 0x01)])
+
+  def test_next_args_change_written_once(self):
+    dev = self.make()
+    dev.sleep()
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    del self.sim.log[:]
+    dev.enable_interrupt()
+    self.assertEqual([cmd for cmd, value in self.sim.log].count(ARGS), 1)
+
+  def test_skipped_write_does_not_wake(self):
+    dev = self.make()
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    dev.sleep()
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    self.assertTrue(self.sim.sleeping)
+    dev.gpo_digital_write(dev.eGPO0, 1, force = True)
+    self.assertFalse(self.sim.sleeping)
+
+  def test_sleep_if_idle(self):
+    dev = self.make()
+    activity = dev.get_activity()
+    dev.gpo_digital_write(dev.eGPO0, 1)
+    self.assertIsNone(dev.sleep_if_idle(activity))
+    self.assertFalse(self.sim.sleeping)
+    activity = dev.get_activity()
+    self.assertEqual(dev.sleep_if_idle(activity), dev.get_activity())
+    self.assertTrue(self.sim.sleeping)
+
+  def test_no_sleep_while_scanning(self):
+    dev = self.make()
+    dev.display_mode(8)
+    self.assertIsNone(dev.sleep_if_idle(dev.get_activity()))
+    self.assertFalse(self.sim.sleeping)
+
+  def test_power_manager(self):
+    dev = self.make()
+    power = CH423PowerManager(dev, idle_time = 0.01, interval = 0.002)
+    power.start()
+    try:
+      self.assertTrue(wait_for(lambda: self.sim.sleeping))
+      dev.gpo_digital_write(dev.eGPO0, 1)
+      self.assertTrue(wait_for(lambda: power.get_stats()["wakes"] == 1))
+    finally:
+      power.stop()
+    self.assertEqual(self.sim.sleep_count, power.get_stats()["sleeps"])
+
+  def test_power_manager_keeps_display_awake(self):
+    dev = self.make()
+    dev.display_mode(8)
+    power = CH423PowerManager(dev, idle_time = 0.01, interval = 0.002)
+    power.start()
+    time.sleep(0.05)
+    power.stop()
+    self.assertEqual(power.get_stats()["sleeps"], 0)
+    self.assertEqual(self.sim.sleep_count, 0)
+
+
+class TestDisplay(DriverTestCase):
+  def test_restore_gpio_mode_and_latch(self):
+    dev = self.make(DFRobot_CH423.eOUTPUT)
+    dev.gpio_digital_write(dev.eGPIO_TOTAL, 0x5A)
+    self.assertEqual(dev.display_mode(16), 16)
+    self.assertEqual(self.sim.args & (IO_EN | DEC_L | DEC_H), IO_EN | DEC_L | DEC_H)
+    dev.display_text("8.8.")
+    self.assertEqual(self.sim.digits[:2], [0xFF, 0xFF])
+    self.assertEqual(dev.display_mode(0), 0)
+    self.assertEqual(self.sim.args & (IO_EN | DEC_L | DEC_H), IO_EN)
+    self.assertEqual(self.sim.gpio_latch, 0x5A)
+
+  def test_input_mode_restored(self):
+    dev = self.make(DFRobot_CH423.eINPUT)
+    dev.display_mode(8)
+    dev.display_mode(0)
+    self.assertEqual(self.sim.args & IO_EN, 0)
+
+  def test_interrupt_suspended_while_scanning(self):
+    dev = self.make()
+    dev.gpio_attach_interrupt(dev.eGPIO0, dev.eFALLING, None)
+    dev.enable_interrupt()
+    self.assertEqual(dev.display_mode(16), 16)
+    self.assertEqual(self.sim.args & (INT_EN | DEC_H), DEC_H)
+    dev.display_mode(0)
+    self.assertEqual(self.sim.args & (IO_EN | INT_EN | DEC_L | DEC_H), INT_EN)
+    self.assertEqual(self.sim.gpio_latch, 0xFF)
+
+  def test_interrupt_switched_while_scanning(self):
+    dev = self.make()
+    dev.gpio_attach_interrupt(dev.eGPIO0, dev.eFALLING, None)
+    dev.display_mode(8)
+    dev.enable_interrupt()
+    self.assertEqual(self.sim.args & INT_EN, 0)
+    dev.display_mode(0)
+    self.assertEqual(self.sim.args & INT_EN, INT_EN)
+    dev.display_mode(8)
+    dev.disable_interrupt()
+    dev.display_mode(0)
+    self.assertEqual(self.sim.args & INT_EN, 0)
+
+  def test_unknown_character_rejected(self):
+    dev = self.make()
+    dev.display_mode(8)
+    self.assertIsNone(dev.display_text("12x"))
+    self.assertEqual(self.sim.digits[1:3], [0, 0])
+
+
+class TestSampler(DriverTestCase):
+  def test_blocks_hold_samples_in_order(self):
+    dev = self.make()
+    sampler = CH423Sampler(dev, block_size = 4, blocks = 4)
+    sampler.start()
+    self.assertTrue(wait_for(lambda: sampler.get_stats()["blocks"] >= 2))
+    sampler.stop()
+    blocks = [(b.seq, b.length, list(b.timestamps[:b.length])) for b in sampler.blocks(timeout = 0)]
+    self.assertTrue(blocks)
+    for seq, length, stamps in blocks:
+      self.assertEqual(stamps, sorted(stamps))
+    stats = sampler.get_stats()
+    self.assertEqual(stats["stored"], sum(length for seq, length, stamps in blocks) + 4 * stats["dropped"])
+
+  def test_full_ring_drops_oldest_block(self):
+    dev = self.make()
+    sampler = CH423Sampler(dev, block_size = 2, blocks = 2)
+    sampler.start()
+    self.assertTrue(wait_for(lambda: sampler.get_stats()["dropped"] >= 3))
+    sampler.stop()
+    seqs = [b.seq for b in sampler.blocks(timeout = 0)]
+    self.assertTrue(seqs[0] >= 3)
+
+  def test_changes_only(self):
+    dev = self.make()
+    sampler = CH423Sampler(dev, block_size = 8, blocks = 2, changes_only = True)
+    sampler.start()
+    self.assertTrue(wait_for(lambda: sampler.get_stats()["samples"] >= 100))
+    self.sim.set_inputs(0x0F)
+    samples = sampler.get_stats()["samples"]
+    self.assertTrue(wait_for(lambda: sampler.get_stats()["samples"] >= samples + 100))
+    sampler.stop()
+    levels = [list(b.levels[:b.length]) for b in sampler.blocks(timeout = 0)]
+    self.assertEqual(levels, [[0xFF, 0x0F]])
+
+  def hold_every_block(self, sampler):
+    # stop after one full and one partial block, so both blocks end up filled and can be taken
+    dev   = self.dev
+    reads = [0]
+    def read(pin, _read = dev.gpio_digital_read):
+      reads[0] += 1
+      if reads[0] == 6:
+        sampler.stop()
+      return _read(pin)
+    dev.gpio_digital_read = read
+    sampler.start()
+    self.assertTrue(wait_for(lambda: sampler.get_stats()["blocks"] == 2))
+    del dev.gpio_digital_read
+    first, second = sampler.blocks(timeout = 0), sampler.blocks(timeout = 0)
+    self.assertEqual(next(first).length, 4)
+    self.assertEqual(next(second).length, 2)
+    return first, second
+
+  def test_restart_while_consumer_holds_every_block(self):
+    dev = self.make()
+    sampler = CH423Sampler(dev, block_size = 4, blocks = 2)
+    first, second = self.hold_every_block(sampler)
+    sampler.start()
+    time.sleep(0.02)
+    self.assertTrue(sampler.is_running())
+    self.assertEqual(sampler.get_stats()["samples"], 6)
+    first.close()
+    second.close()
+    self.assertTrue(wait_for(lambda: sampler.get_stats()["blocks"] > 2))
+    sampler.stop()
+
+  def test_stop_while_waiting_for_a_block(self):
+    dev = self.make()
+    sampler = CH423Sampler(dev, block_size = 4, blocks = 2)
+    first, second = self.hold_every_block(sampler)
+    sampler.start()
+    sampler.stop()
+    self.assertFalse(sampler.is_running())
+    self.assertEqual(list(sampler.blocks(timeout = 0)), [])
+    first.close()
+    second.close()
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding:utf-8 -*-
+from __future__ import print_function
+
+
+'''!
+  @file ch423_trace.py
+  @brief Summarise or replay a bus trace recorded with DFRobot_CH423.start_trace() or CH423TraceRecorder.
+  @n    python ch423_trace.py summary capture.trace
+  @n    python ch423_trace.py replay capture.trace            (recorded timing)
+  @n    python ch423_trace.py replay capture.trace --speed 0  (maximum speed)
+  @n    python ch423_trace.py dump capture.trace
+  @n  replay feeds the trace through CH423Simulator and prints the final chip state, so a field capture can be checked
+  @n  against the expected output levels.
+
+  @copyright   Copyright (c) 2010 DFRobot Co.Ltd (http://www.dfrobot.com)
+  @license     The MIT License (MIT)
+  @url https://github.com/DFRobot/DFRobot_CH423
+'''
+
+import sys
+import os
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from DFRobot_CH423 import *
+from DFRobot_CH423_simulator import CH423Simulator
+from DFRobot_CH423_trace import CH423TraceReader
+
+COMMANDS = {
+  DFRobot_CH423.CH423_CMD_SET_SYSTEM_ARGS: "SET_SYSTEM_ARGS",
+  DFRobot_CH423.CH423_CMD_SET_GPO_L:       "SET_GPO_L",
+  DFRobot_CH423.CH423_CMD_SET_GPO_H:       "SET_GPO_H",
+  DFRobot_CH423.CH423_CMD_SET_GPIO:        "SET_GPIO",
+  DFRobot_CH423.CH423_CMD_READ_GPIO:       "READ_GPIO",
+}
+
+def command_name(cmd):
+  return COMMANDS.get(cmd, "0x%02X"%cmd)
+
+def main():
+  parser = argparse.ArgumentParser(description = "CH423 bus trace tool")
+  parser.add_argument("action", choices = ("summary", "replay", "dump"))
+  parser.add_argument("trace", help = "trace file")
+  parser.add_argument("--speed", type = float, default = 1.0, help = "replay speed factor, 0 for maximum speed")
+  args = parser.parse_args()
+
+  trace = CH423TraceReader(args.trace)
+  if args.action == "dump":
+    start = None
+    for stamp, cmd, value, read, error in trace:
+      if start is None:
+        start = stamp
+      print("%12.6f %-5s %-16s 0x%02X%s"%(stamp - start, "read" if read else "write", command_name(cmd), value, " error" if error else ""))
+    return
+
+  summary = trace.summary()
+  summary["commands"] = dict((command_name(cmd), n) for cmd, n in summary["commands"].items())
+  if args.action == "summary":
+    print(json.dumps(summary, indent = 2, sort_keys = True))
+    return
+
+  sim = CH423Simulator()
+  result = trace.replay(sim, args.speed)
+  result["summary"] = summary
+  result["state"] = {"args": sim.args, "gpo_l": sim.gpo_l, "gpo_h": sim.gpo_h, "gpio_latch": sim.gpio_latch}
+  print(json.dumps(result, indent = 2, sort_keys = True))
+
+if __name__ == "__main__":
+  main()